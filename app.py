@@ -1,17 +1,60 @@
 import streamlit as st
+from streamlit.errors import StreamlitSecretNotFoundError
 import pandas as pd
 import json
 import os
-import io
 import requests
-import shutil
-import re
+import time
+import threading
+import hashlib
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from base64 import b64decode
+
+from service_engine import (
+    build_fleet_report,
+    build_service_status_table,
+    card_number_from_sheet,
+    create_fleet_executor,
+    machine_tonnage_defaults,
+    merge_sorted_rows,
+    plan_bulk_import,
+    resolve_sheet_schema,
+    select_plan_slices,
+)
+from perf_spans import PerfHistory, finish_run, run_scope, span, start_run, summarize_runs
+from push_worker import GitHubPushWorker
+from session_store import LOGIN_ALREADY_ACTIVE, LOGIN_LIMIT_REACHED, SessionStore
+from user_store import ROLE_PERMISSIONS, UserStore, default_users, hash_password, verify_password
+from workbook_store import (
+    EXPORT_FORMATS,
+    IMPORT_EXTENSIONS,
+    LazySheets,
+    PatchNotApplicable,
+    StaleWorkbookError,
+    VersionedSheetCache,
+    WORKBOOK_WRITE_LOCK,
+    WorkbookVersion,
+    append_patch_log,
+    apply_change_set,
+    carry_over_version,
+    change_set_size,
+    editor_change_set,
+    export_table_bytes,
+    file_sha256,
+    frame_digest,
+    patch_workbook_atomic,
+    read_import_table,
+    remove_sidecar_version,
+    write_workbook_atomic,
+)
+
+# نسخ التحرير الخفيفة تعتمد على Copy-on-Write (مفعل افتراضياً منذ pandas 3)
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # محاولة استيراد PyGithub (لرفع التعديلات)
 try:
-    from github import Github
+    from github import Github, GithubException
     GITHUB_AVAILABLE = True
 except Exception:
     GITHUB_AVAILABLE = False
@@ -34,6 +77,22 @@ APP_CONFIG = {
     "MAX_ACTIVE_USERS": 2,
     "SESSION_DURATION_MINUTES": 15,
     
+    # مزامنة الملف من GitHub في الخلفية (بالثواني)
+    "SYNC_INTERVAL_SECONDS": 300,
+    
+    # عدد إصدارات الملف المحفوظة في الكاش
+    "CACHE_MAX_VERSIONS": 3,
+    
+    # تقرير الأسطول: عدد العمليات (None = عدد الأنوية) والحد الأدنى للماكينات لاستخدام التوازي
+    "FLEET_WORKERS": None,
+    "FLEET_PARALLEL_MIN_CARDS": 8,
+    
+    # إعدادات الحفظ التلقائي لمحرر البيانات (بالثواني)
+    "AUTOSAVE_DEBOUNCE_SECONDS": 30,
+    "AUTOSAVE_CHECK_SECONDS": 5,
+    "PERF_HISTORY_RUNS": 500,
+    "TABLE_PAGE_SIZE": 100,
+    
     # إعدادات الواجهة
     "SHOW_TECH_SUPPORT_TO_ALL": False,
     "CUSTOM_TABS": ["📊 عرض وفحص الماكينات", "🛠 تعديل وإدارة البيانات", "👥 إدارة المستخدمين", "📞 الدعم الفني"]
@@ -44,6 +103,10 @@ APP_CONFIG = {
 # ===============================
 USERS_FILE = "users.json"
 STATE_FILE = "state.json"
+SESSION_DB_FILE = "sessions.db"
+PUSH_QUEUE_FILE = "push_queue.json"
+SYNC_META_FILE = "sync_meta.json"
+PATCH_LOG_FILE = "edit_patches.jsonl"
 SESSION_DURATION = timedelta(minutes=APP_CONFIG["SESSION_DURATION_MINUTES"])
 MAX_ACTIVE_USERS = APP_CONFIG["MAX_ACTIVE_USERS"]
 
@@ -53,143 +116,63 @@ GITHUB_EXCEL_URL = f"https://github.com/{APP_CONFIG['REPO_NAME'].split('/')[0]}/
 # -------------------------------
 # 🧩 دوال مساعدة للملفات والحالة
 # -------------------------------
+# ملف المستخدمين يقرأ ويرحّل مرة واحدة لكل إصدار
+@st.cache_resource(show_spinner=False)
+def get_user_store():
+    return UserStore(USERS_FILE)
+
 def load_users():
     """تحميل بيانات المستخدمين من ملف JSON"""
-    if not os.path.exists(USERS_FILE):
-        # إنشاء مستخدمين افتراضيين مع الصلاحيات المطلوبة
-        default_users = {
-            "admin": {
-                "password": "admin123", 
-                "role": "admin", 
-                "created_at": datetime.now().isoformat(),
-                "permissions": ["all"]
-            },
-            "user1": {
-                "password": "user1123", 
-                "role": "editor", 
-                "created_at": datetime.now().isoformat(),
-                "permissions": ["view", "edit"]
-            },
-            "user2": {
-                "password": "user2123", 
-                "role": "viewer", 
-                "created_at": datetime.now().isoformat(),
-                "permissions": ["view"]
-            }
-        }
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(default_users, f, indent=4, ensure_ascii=False)
-        return default_users
     try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            users = json.load(f)
-            # التأكد من وجود جميع الحقول المطلوبة لكل مستخدم
-            for username, user_data in users.items():
-                if "role" not in user_data:
-                    # تحديد الدور بناءً على اسم المستخدم إذا لم يكن موجوداً
-                    if username == "admin":
-                        user_data["role"] = "admin"
-                        user_data["permissions"] = ["all"]
-                    else:
-                        user_data["role"] = "viewer"
-                        user_data["permissions"] = ["view"]
-                
-                if "permissions" not in user_data:
-                    # تعيين الصلاحيات الافتراضية بناءً على الدور
-                    if user_data["role"] == "admin":
-                        user_data["permissions"] = ["all"]
-                    elif user_data["role"] == "editor":
-                        user_data["permissions"] = ["view", "edit"]
-                    else:
-                        user_data["permissions"] = ["view"]
-                        
-                if "created_at" not in user_data:
-                    user_data["created_at"] = datetime.now().isoformat()
-                    
-            return users
+        return get_user_store().load()
     except Exception as e:
         st.error(f"❌ خطأ في ملف users.json: {e}")
-        # إرجاع المستخدمين الافتراضيين في حالة الخطأ
-        return {
-            "admin": {
-                "password": "admin123", 
-                "role": "admin", 
-                "created_at": datetime.now().isoformat(),
-                "permissions": ["all"]
-            }
-        }
+        # إرجاع المستخدم الافتراضي admin في حالة الخطأ
+        return {"admin": default_users()["admin"]}
 
 def save_users(users):
     """حفظ بيانات المستخدمين إلى ملف JSON"""
     try:
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(users, f, indent=4, ensure_ascii=False)
+        get_user_store().save(users)
         return True
     except Exception as e:
         st.error(f"❌ خطأ في حفظ ملف users.json: {e}")
         return False
 
-def load_state():
-    if not os.path.exists(STATE_FILE):
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump({}, f, indent=4, ensure_ascii=False)
-        return {}
-    try:
-        with open(STATE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_state(state):
-    with open(STATE_FILE, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=4, ensure_ascii=False)
-
-def cleanup_sessions(state):
-    now = datetime.now()
-    changed = False
-    for user, info in list(state.items()):
-        if info.get("active") and "login_time" in info:
-            try:
-                login_time = datetime.fromisoformat(info["login_time"])
-                if now - login_time > SESSION_DURATION:
-                    info["active"] = False
-                    info.pop("login_time", None)
-                    changed = True
-            except:
-                info["active"] = False
-                changed = True
-    if changed:
-        save_state(state)
-    return state
-
-def remaining_time(state, username):
-    if not username or username not in state:
-        return None
-    info = state.get(username)
-    if not info or not info.get("active"):
-        return None
-    try:
-        lt = datetime.fromisoformat(info["login_time"])
-        remaining = SESSION_DURATION - (datetime.now() - lt)
-        if remaining.total_seconds() <= 0:
-            return None
-        return remaining
-    except:
-        return None
+# الجلسات في SQLite - state.json القديم ينقل تلقائياً عند أول تشغيل
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    store = SessionStore(SESSION_DB_FILE, SESSION_DURATION, MAX_ACTIVE_USERS)
+    store.migrate_from_json(STATE_FILE)
+    return store
 
 # -------------------------------
 # 🔐 تسجيل الخروج
 # -------------------------------
-def logout_action():
-    state = load_state()
+def logout_action(expired=False):
+    # التعديلات المعلقة في المحرر تحفظ قبل مسح الجلسة
+    pending = st.session_state.get("edit_pending")
+    if pending and not pending.get("conflict"):
+        sheets_dict = load_sheets_for_edit()
+        if sheets_dict is not None:
+            flush_pending_edits(sheets_dict)
+    pending = st.session_state.get("edit_pending")
+    if pending and not expired:
+        st.warning(
+            f"⚠ تغييرات {pending['sheet']} المعلقة ({pending['changes']}) لم تحفظ. "
+            "احفظها أو تجاهلها من تبويب التعديل قبل تسجيل الخروج."
+        )
+        return
+
     username = st.session_state.get("username")
-    if username and username in state:
-        state[username]["active"] = False
-        state[username].pop("login_time", None)
-        save_state(state)
+    if username:
+        get_session_store().logout(username)
     keys = list(st.session_state.keys())
     for k in keys:
         st.session_state.pop(k, None)
+    if pending:
+        # انتهت الجلسة قبل حفظ التعديلات - تعرض للمستخدم بعد الخروج حتى لا تضيع بصمت
+        st.session_state["unsaved_on_logout"] = pending
     st.rerun()
 
 # -------------------------------
@@ -197,7 +180,7 @@ def logout_action():
 # -------------------------------
 def login_ui():
     users = load_users()
-    state = cleanup_sessions(load_state())
+    session_store = get_session_store()
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
         st.session_state.username = None
@@ -206,27 +189,30 @@ def login_ui():
 
     st.title(f"{APP_CONFIG['APP_ICON']} تسجيل الدخول - {APP_CONFIG['APP_TITLE']}")
 
+    unsaved = st.session_state.get("unsaved_on_logout")
+    if unsaved:
+        st.warning(f"⚠ انتهت الجلسة قبل حفظ تغييرات {unsaved['sheet']} ({unsaved['changes']}) - لم يتم حفظها:")
+        st.json(unsaved["change_set"], expanded=False)
+
     # اختيار المستخدم
     username_input = st.selectbox("👤 اختر المستخدم", list(users.keys()))
     password = st.text_input("🔑 كلمة المرور", type="password")
 
-    active_users = [u for u, v in state.items() if v.get("active")]
-    active_count = len(active_users)
+    active_count = len(session_store.active_users())
     st.caption(f"🔒 المستخدمون النشطون الآن: {active_count} / {MAX_ACTIVE_USERS}")
 
     if not st.session_state.logged_in:
         if st.button("تسجيل الدخول"):
-            if username_input in users and users[username_input]["password"] == password:
-                if username_input == "admin":
-                    pass
-                elif username_input in active_users:
+            if username_input in users and verify_password(users[username_input].get("password"), password):
+                # الفحص والتسجيل في معاملة واحدة حتى لا يتجاوز تسجيلان متزامنان الحد الأقصى
+                login_result = session_store.try_login(username_input, exempt=username_input == "admin")
+                if login_result == LOGIN_ALREADY_ACTIVE:
                     st.warning("⚠ هذا المستخدم مسجل دخول بالفعل.")
                     return False
-                elif active_count >= MAX_ACTIVE_USERS:
+                elif login_result == LOGIN_LIMIT_REACHED:
                     st.error("🚫 الحد الأقصى للمستخدمين المتصلين حالياً.")
                     return False
-                state[username_input] = {"active": True, "login_time": datetime.now().isoformat()}
-                save_state(state)
+                st.session_state.pop("unsaved_on_logout", None)
                 st.session_state.logged_in = True
                 st.session_state.username = username_input
                 st.session_state.user_role = users[username_input].get("role", "viewer")
@@ -240,13 +226,13 @@ def login_ui():
         username = st.session_state.username
         user_role = st.session_state.user_role
         st.success(f"✅ مسجل الدخول كـ: {username} ({user_role})")
-        rem = remaining_time(state, username)
+        rem = session_store.remaining(username)
         if rem:
             mins, secs = divmod(int(rem.total_seconds()), 60)
             st.info(f"⏳ الوقت المتبقي: {mins:02d}:{secs:02d}")
         else:
             st.warning("⏰ انتهت الجلسة، سيتم تسجيل الخروج.")
-            logout_action()
+            logout_action(expired=True)
         if st.button("🚪 تسجيل الخروج"):
             logout_action()
         return True
@@ -254,119 +240,378 @@ def login_ui():
 # -------------------------------
 # 🔄 طرق جلب الملف من GitHub
 # -------------------------------
+def github_token():
+    """GitHub token من secrets - None إذا لم يوجد ملف secrets أو لم يضبط فيه token"""
+    try:
+        return st.secrets.get("github", {}).get("token", None)
+    except (StreamlitSecretNotFoundError, FileNotFoundError):
+        return None
+
+# نتيجة فحص المزامنة
+SYNC_UPDATED = "updated"
+SYNC_UNCHANGED = "unchanged"
+SYNC_DEFERRED = "deferred"
+SYNC_DIVERGED = "diverged"
+
+def load_sync_meta():
+    """آخر إصدار متطابق مع GitHub (ETag وبصمة الملف و SHA الـ blob) - بعد تحميل أو رفع"""
+    if not os.path.exists(SYNC_META_FILE):
+        return {}
+    try:
+        with open(SYNC_META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_sync_meta(meta):
+    # عامل الرفع وخدمة المزامنة يكتبان من خيطين مختلفين
+    with WORKBOOK_WRITE_LOCK:
+        tmp_path = f"{SYNC_META_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, SYNC_META_FILE)
+
+def git_blob_sha(content):
+    """SHA الـ blob كما يحسبه Git (نفس قيمة sha في GitHub contents API)"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def record_synced_version(content, etag=None):
+    """تسجيل المحتوى كآخر إصدار متطابق بين الملف المحلي و GitHub"""
+    save_sync_meta({"etag": etag, "sha256": hashlib.sha256(content).hexdigest(), "blob_sha": git_blob_sha(content)})
+
+def replace_local_file(content):
+    """استبدال الملف المحلي بالمحتوى الجديد دفعة واحدة"""
+    tmp_path = f"{APP_CONFIG['LOCAL_FILE']}.download"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, APP_CONFIG["LOCAL_FILE"])
+
+def local_file_matches(content_sha):
+    return os.path.exists(APP_CONFIG["LOCAL_FILE"]) and file_sha256(APP_CONFIG["LOCAL_FILE"]) == content_sha
+
+def local_file_is_synced(meta):
+    """الملف المحلي لم يعدل منذ آخر مزامنة - وإلا فيه حفظ محلي لا يجب استبداله"""
+    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        return True
+    return bool(meta.get("sha256")) and local_file_matches(meta["sha256"])
+
+def replace_if_synced(content, meta, etag=None, force=False):
+    """استبدال الملف المحلي بنسخة GitHub تحت قفل الحفظ - فقط إذا لم يعدل محلياً منذ آخر مزامنة"""
+    with WORKBOOK_WRITE_LOCK:
+        if not force and not local_file_is_synced(meta):
+            return SYNC_DIVERGED
+        replace_local_file(content)
+        record_synced_version(content, etag)
+    return SYNC_UPDATED
+
+def download_if_changed(can_replace=None, force=False):
+    """تحميل الملف من رابط RAW فقط إذا تغير (طلب مشروط بالـ ETag) - يعيد إحدى قيم SYNC_*
+
+    force: استبدال الملف حتى لو عدل محلياً (تحديث يطلبه المستخدم بنفسه)."""
+    meta = load_sync_meta()
+    headers = {}
+    # الـ ETag صالح فقط إذا لم يتغير الملف المحلي منذ آخر تحميل
+    if meta.get("etag") and local_file_matches(meta.get("sha256")):
+        headers["If-None-Match"] = meta["etag"]
+
+    response = requests.get(GITHUB_EXCEL_URL, headers=headers, timeout=15)
+    if response.status_code == 304:
+        return SYNC_UNCHANGED
+    response.raise_for_status()
+
+    # البيانات تحفظ فقط عندما يطابق الملف المحلي هذه النسخة - وإلا يتخطى الـ ETag تحديثاً لم يطبق
+    etag = response.headers.get("ETag")
+    if local_file_matches(hashlib.sha256(response.content).hexdigest()):
+        record_synced_version(response.content, etag)
+        return SYNC_UNCHANGED
+    if can_replace is not None and not can_replace():
+        return SYNC_DEFERRED
+    return replace_if_synced(response.content, meta, etag, force)
+
+def sync_from_github_api(client, can_replace=None):
+    """فحص SHA الملف عبر contents API (بدون كاش الـ CDN) ومقارنته بآخر إصدار تم تحميله أو رفعه"""
+    meta = load_sync_meta()
+    remote_sha = client.remote_file_sha()
+    if remote_sha is None or remote_sha == meta.get("blob_sha"):
+        return SYNC_UNCHANGED
+    if os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+            local_content = f.read()
+        if git_blob_sha(local_content) == remote_sha:
+            record_synced_version(local_content)
+            return SYNC_UNCHANGED
+    if can_replace is not None and not can_replace():
+        return SYNC_DEFERRED
+    if not local_file_is_synced(meta):
+        return SYNC_DIVERGED
+    return replace_if_synced(client.fetch_file(), meta)
+
 def fetch_from_github_requests():
     """تحميل بإستخدام رابط RAW (requests)"""
     try:
-        response = requests.get(GITHUB_EXCEL_URL, stream=True, timeout=15)
-        response.raise_for_status()
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            shutil.copyfileobj(response.raw, f)
-        # امسح الكاش
-        try:
-            st.cache_data.clear()
-        except:
-            pass
+        if download_if_changed(force=True) != SYNC_UPDATED:
+            st.info("✅ الملف المحلي مطابق لنسخة GitHub - لا يوجد تحديث.")
+            return False
         return True
     except Exception as e:
         st.error(f"⚠ فشل التحديث من GitHub: {e}")
         return False
 
+class WorkbookSyncService:
+    """خدمة خلفية تتحقق دورياً من نسخة GitHub وتستبدل الملف المحلي عند تغيره فقط"""
+
+    def __init__(self, interval_seconds, sync_func):
+        self._interval = interval_seconds
+        self._sync_func = sync_func
+        self._lock = threading.Lock()
+        self._status = {"last_check": None, "last_update": None, "last_error": None, "diverged": False}
+        self._thread = threading.Thread(target=self._run, name="workbook-sync", daemon=True)
+        self._thread.start()
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def sync_once(self):
+        """فحص واحد - يعيد True إذا تم تحميل نسخة جديدة"""
+        try:
+            result = self._sync_func()
+            error = None
+        except Exception as e:
+            result, error = None, str(e)
+        updated = result == SYNC_UPDATED
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._status["last_check"] = now
+            self._status["last_error"] = error
+            if result is not None:
+                self._status["diverged"] = result == SYNC_DIVERGED
+            if updated:
+                self._status["last_update"] = now
+        return updated
+
+    def _run(self):
+        while True:
+            self.sync_once()
+            time.sleep(self._interval)
+
 def fetch_from_github_api():
     """تحميل عبر GitHub API (باستخدام PyGithub token في secrets)"""
     if not GITHUB_AVAILABLE:
         return fetch_from_github_requests()
     
     try:
-        token = st.secrets.get("github", {}).get("token", None)
+        token = github_token()
         if not token:
             return fetch_from_github_requests()
         
-        g = Github(token)
-        repo = g.get_repo(APP_CONFIG["REPO_NAME"])
-        file_content = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
-        content = b64decode(file_content.content)
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            f.write(content)
-        try:
-            st.cache_data.clear()
-        except:
-            pass
+        content = get_github_client(token).fetch_file()
+        content_sha = hashlib.sha256(content).hexdigest()
+        if local_file_matches(content_sha):
+            record_synced_version(content)
+            st.info("✅ الملف المحلي مطابق لنسخة GitHub - لا يوجد تحديث.")
+            return False
+
+        replace_if_synced(content, load_sync_meta(), force=True)
         return True
     except Exception as e:
         st.error(f"⚠ فشل تحميل الملف من GitHub: {e}")
         return False
 
 # -------------------------------
-# 📂 تحميل الشيتات (مخبأ) - معدل لقراءة جميع الشيتات
+# 📂 تحميل الشيتات (مخبأ) - قراءة واحدة للملف لنسختي العرض والتحرير
 # -------------------------------
-@st.cache_data(show_spinner=False)
-def load_all_sheets():
-    """تحميل جميع الشيتات من ملف Excel"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+@st.cache_data(show_spinner=False, max_entries=16)
+def workbook_sha256(path, mtime_ns, size):
+    """بصمة الملف - يعاد حسابها فقط عند تغير وقت التعديل أو الحجم"""
+    return file_sha256(path)
+
+def current_workbook_sha():
+    """بصمة ملف Excel المحلي الحالي (أو None إذا لم يكن موجوداً)"""
+    path = APP_CONFIG["LOCAL_FILE"]
+    if not os.path.exists(path):
         return None
-    
-    try:
-        # قراءة جميع الشيتات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None)
-        
-        if not sheets:
-            return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
-    except Exception as e:
+    stat = os.stat(path)
+    return workbook_sha256(path, stat.st_mtime_ns, stat.st_size)
+
+# مخزن الشيتات حسب إصدار الملف (مشترك بين الجلسات)
+@st.cache_resource(show_spinner=False)
+def get_sheet_cache():
+    return VersionedSheetCache(APP_CONFIG["CACHE_MAX_VERSIONS"])
+
+# سجل زمن المراحل لآخر التشغيلات (مشترك بين الجلسات)
+@st.cache_resource(show_spinner=False)
+def get_perf_history():
+    return PerfHistory(APP_CONFIG["PERF_HISTORY_RUNS"])
+
+def invalidate_workbook_version(workbook_sha):
+    """مسح الكاش والنسخة السريعة لإصدار واحد من الملف"""
+    if not workbook_sha:
+        return
+    get_sheet_cache().invalidate(workbook_sha)
+    remove_sidecar_version(workbook_sha)
+
+def workbook_version(workbook_sha):
+    """إصدار الملف المحلي عبر المخزن المشترك"""
+    return WorkbookVersion(APP_CONFIG["LOCAL_FILE"], workbook_sha, get_sheet_cache())
+
+def _lazy_workbook(loader_name):
+    workbook_sha = current_workbook_sha()
+    if workbook_sha is None:
         return None
+    version = workbook_version(workbook_sha)
+    return version.lazy(getattr(version, loader_name))
+
+def load_all_sheets():
+    """تحميل الشيتات للعرض والتحليل (أنواع بيانات مستنتجة) - كل شيت عند طلبه"""
+    return _lazy_workbook("typed")
 
 # نسخة مع dtype=object لواجهة التحرير
-@st.cache_data(show_spinner=False)
 def load_sheets_for_edit():
-    """تحميل جميع الشيتات للتحرير"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
-        return None
-    
-    try:
-        # قراءة جميع الشيتات مع dtype=object للحفاظ على تنسيق البيانات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None, dtype=object)
-        
-        if not sheets:
-            return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
-    except Exception as e:
-        return None
+    """تحميل الشيتات للتحرير (من نفس القراءة الخام) - كل شيت عند طلبه"""
+    return _lazy_workbook("for_edit")
+
+def load_sheet_schemas():
+    """أدوار الأعمدة لكل شيت - تحسب عند طلب الشيت"""
+    return _lazy_workbook("schema") or {}
+
+def load_tonnage_indexes():
+    """فهارس نطاقات الأطنان لكل شيت - تبنى عند طلب الشيت"""
+    return _lazy_workbook("tonnage_index") or {}
+
+def load_row_insert_indexes():
+    """مفاتيح الأطنان المرتبة لإضافة الصفوف - تبنى عند طلب الشيت"""
+    return _lazy_workbook("row_insert_index") or {}
+
+# -------------------------------
+# 📤 رفع الملف إلى GitHub في الخلفية
+# -------------------------------
+class GitHubRepoClient:
+    """عميل GitHub مشترك يحتفظ بمقبض المستودع وآخر SHA معروف للملف"""
+
+    # أكواد GitHub التي تعني أن الـ SHA المحفوظ لم يعد صحيحاً
+    STALE_SHA_STATUSES = (404, 409, 422)
+
+    def __init__(self, token):
+        self._github = Github(token)
+        self._repo = self._github.get_repo(APP_CONFIG["REPO_NAME"], lazy=True)
+        self._lock = threading.Lock()
+        self.file_sha = None
+
+    def fetch_file(self):
+        """تحميل الملف من GitHub مع حفظ الـ SHA الحالي"""
+        with self._lock:
+            file_content = self._repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
+            self.file_sha = file_content.sha
+            return file_content.decoded_content
+
+    def remote_file_sha(self):
+        """SHA الـ blob الحالي للملف في الفرع (None إذا لم يوجد)"""
+        with self._lock:
+            try:
+                return self._repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"]).sha
+            except GithubException as e:
+                if e.status != 404:
+                    raise
+                return None
+
+    def _refresh_sha(self):
+        try:
+            self.file_sha = self._repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"]).sha
+        except GithubException as e:
+            if e.status != 404:
+                raise
+            self.file_sha = None
+
+    def _write(self, content, commit_message):
+        if self.file_sha is None:
+            result = self._repo.create_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, branch=APP_CONFIG["BRANCH"])
+        else:
+            result = self._repo.update_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, sha=self.file_sha, branch=APP_CONFIG["BRANCH"])
+        self.file_sha = result["content"].sha
+
+    def push_file(self, content, commit_message):
+        """رفع محتوى الملف (طلب واحد عادةً) - يعاد جلب الـ SHA فقط عند التعارض"""
+        with self._lock:
+            if self.file_sha is None:
+                self._refresh_sha()
+            try:
+                self._write(content, commit_message)
+            except GithubException as e:
+                if e.status not in self.STALE_SHA_STATUSES:
+                    raise
+                self._refresh_sha()
+                self._write(content, commit_message)
+
+def push_and_record(client, content, commit_message):
+    """رفع الملف ثم تسجيل المحتوى المرفوع كآخر إصدار متطابق (حتى لا تستبدله المزامنة بنسخة أقدم)"""
+    client.push_file(content, commit_message)
+    record_synced_version(content)
+
+@st.cache_resource(show_spinner=False)
+def get_github_client(token):
+    """عميل GitHub واحد لكل token على مستوى عملية الخادم"""
+    return GitHubRepoClient(token)
+
+@st.cache_resource(show_spinner=False)
+def get_sync_service(token):
+    """خدمة مزامنة واحدة لكل عملية خادم - لا تستبدل الملف أثناء وجود تعديلات لم ترفع بعد"""
+    if not token or not GITHUB_AVAILABLE:
+        # بدون token لا يوجد رفع: الحفظ المحلي يمنع الاستبدال عبر بصمة آخر مزامنة
+        return WorkbookSyncService(APP_CONFIG["SYNC_INTERVAL_SECONDS"], download_if_changed)
+    client, push_worker = get_github_client(token), get_push_worker(token)
+    return WorkbookSyncService(
+        APP_CONFIG["SYNC_INTERVAL_SECONDS"],
+        lambda: sync_from_github_api(client, can_replace=lambda: push_worker.pending_count() == 0),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_push_worker(token):
+    """عامل رفع واحد لكل عملية خادم"""
+    client = get_github_client(token)
+    return GitHubPushWorker(
+        lambda content, message: push_and_record(client, content, message),
+        APP_CONFIG["LOCAL_FILE"], PUSH_QUEUE_FILE, perf_history=get_perf_history()
+    )
 
 # -------------------------------
 # 🔁 حفظ محلي + رفع على GitHub + مسح الكاش + إعادة تحميل
 # -------------------------------
-def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit"):
-    """دالة محسنة للحفظ التلقائي المحلي والرفع إلى GitHub"""
-    # احفظ محلياً
+def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit", dirty_sheets=None, patches=None):
+    """دالة محسنة للحفظ التلقائي المحلي والرفع إلى GitHub - patches: تغييرات خلايا فقط لكل شيت"""
+    if dirty_sheets is None and isinstance(sheets_dict, LazySheets):
+        dirty_sheets = sheets_dict.dirty_sheets()
+
+    # احفظ محلياً - فقط فوق نفس الإصدار الذي قرئت منه الشيتات
+    base_sha = getattr(sheets_dict, "version", None)
     try:
-        with pd.ExcelWriter(APP_CONFIG["LOCAL_FILE"], engine="openpyxl") as writer:
-            for name, sh in sheets_dict.items():
+        with span("save_local"):
+            if patches:
                 try:
-                    sh.to_excel(writer, sheet_name=name, index=False)
-                except Exception:
-                    sh.astype(object).to_excel(writer, sheet_name=name, index=False)
+                    patch_workbook_atomic(APP_CONFIG["LOCAL_FILE"], patches, expected_sha=base_sha)
+                except PatchNotApplicable:
+                    # أعمدة لا يمكن تحديد مكانها بالاسم - حفظ الشيت المعدل كاملاً
+                    write_workbook_atomic(APP_CONFIG["LOCAL_FILE"], sheets_dict, dirty_sheets, expected_sha=base_sha)
+            else:
+                write_workbook_atomic(APP_CONFIG["LOCAL_FILE"], sheets_dict, dirty_sheets, expected_sha=base_sha)
+    except StaleWorkbookError:
+        st.error("⚠ تم تحديث الملف من جلسة أخرى أو من GitHub بعد فتحه - لم يتم الحفظ. أعد تحميل الصفحة وأعد المحاولة.")
+        return None
     except Exception as e:
         st.error(f"⚠ خطأ أثناء الحفظ المحلي: {e}")
         return None
-
-    # امسح الكاش
-    try:
-        st.cache_data.clear()
-    except:
-        pass
+    base_sha = base_sha or current_workbook_sha()
+
+    # الشيتات غير المعدلة تنتقل للبصمة الجديدة كما هي؛ المعدلة فقط يعاد تحليلها عند طلبها
+    if dirty_sheets is not None or patches:
+        with span("cache_carry_over"):
+            carry_over_version(
+                get_sheet_cache(), base_sha, current_workbook_sha(),
+                set(dirty_sheets or []) | set(patches or {}), list(sheets_dict)
+            )
 
     # حاول الرفع عبر PyGithub token في secrets
-    token = st.secrets.get("github", {}).get("token", None)
+    token = github_token()
     if not token:
         st.warning("⚠ لم يتم العثور على GitHub token. سيتم الحفظ محلياً فقط.")
         return load_sheets_for_edit()
@@ -375,78 +620,159 @@ def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit
         st.warning("⚠ PyGithub غير متوفر. سيتم الحفظ محلياً فقط.")
         return load_sheets_for_edit()
 
-    try:
-        g = Github(token)
-        repo = g.get_repo(APP_CONFIG["REPO_NAME"])
-        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
-            content = f.read()
+    # الرفع يتم في الخلفية حتى لا تنتظر الواجهة GitHub
+    get_push_worker(token).enqueue(commit_message)
+    st.success(f"✅ تم الحفظ محلياً وجاري الرفع إلى GitHub في الخلفية: {commit_message}")
+    return load_sheets_for_edit()
 
-        try:
-            contents = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
-            result = repo.update_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, sha=contents.sha, branch=APP_CONFIG["BRANCH"])
-            st.success(f"✅ تم الحفظ والرفع إلى GitHub بنجاح: {commit_message}")
-            return load_sheets_for_edit()
-        except Exception as e:
-            # حاول رفع كملف جديد أو إنشاء
-            try:
-                result = repo.create_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, branch=APP_CONFIG["BRANCH"])
-                st.success(f"✅ تم إنشاء ملف جديد على GitHub: {commit_message}")
-                return load_sheets_for_edit()
-            except Exception as create_error:
-                st.error(f"❌ فشل إنشاء ملف جديد على GitHub: {create_error}")
-                return None
-
-    except Exception as e:
-        st.error(f"❌ فشل الرفع إلى GitHub: {e}")
-        return None
-
-def auto_save_to_github(sheets_dict, operation_description):
+def auto_save_to_github(sheets_dict, operation_description, patches=None):
     """دالة الحفظ التلقائي المحسنة"""
     username = st.session_state.get("username", "unknown")
     commit_message = f"{operation_description} by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     
-    result = save_local_excel_and_push(sheets_dict, commit_message)
+    result = save_local_excel_and_push(sheets_dict, commit_message, patches=patches)
     if result is not None:
-        st.success("✅ تم حفظ التغييرات تلقائياً في GitHub")
+        st.success("✅ تم حفظ التغييرات تلقائياً")
         return result
     else:
         st.error("❌ فشل الحفظ التلقائي")
         return sheets_dict
 
+# -------------------------------
+# ⏳ تجميع تعديلات المحرر وحفظها دفعة واحدة
+# -------------------------------
+def pending_edit_base(sheets_dict, sheet_name):
+    """الإصدار الذي أخذت منه أرقام صفوف التعديلات + بصمة الشيت فيه (لإعادة التطبيق على إصدار أحدث)"""
+    return {"base": sheets_dict.version, "base_digest": frame_digest(sheets_dict[sheet_name])}
+
+def flush_pending_edits(sheets_dict):
+    """حفظ ورفع التعديلات المعلقة في حفظ واحد و commit واحد - الخلايا المتغيرة فقط"""
+    pending = st.session_state.pop("edit_pending", None)
+    if not pending or pending.get("conflict"):
+        if pending:
+            st.session_state["edit_pending"] = pending
+        return None
+    sheet_name, change_set = pending["sheet"], pending["change_set"]
+
+    # أرقام الصفوف صالحة فقط على الإصدار الذي بني عليه المحرر
+    current_sha = current_workbook_sha()
+    if pending["base"] != current_sha or sheets_dict.version != current_sha:
+        latest = load_sheets_for_edit()
+        if latest is None or sheet_name not in latest or frame_digest(latest[sheet_name]) != pending["base_digest"]:
+            # الشيت نفسه تغير (حفظ من جلسة أخرى أو مزامنة) - لا تكتب خلايا في صفوف خاطئة
+            pending["conflict"] = True
+            st.session_state["edit_pending"] = pending
+            return None
+        # الشيت لم يتغير (التحديث في شيتات أخرى) - نفس التغييرات تطبق على الإصدار الجديد
+        sheets_dict = latest
+
+    base_sha = sheets_dict.version
+    sheets_dict[sheet_name] = apply_change_set(sheets_dict[sheet_name], change_set)
+    new_sheets = auto_save_to_github(
+        sheets_dict,
+        f"تعديل {pending['changes']} تغيير في شيت {sheet_name}",
+        patches={sheet_name: change_set}
+    )
+    if new_sheets is sheets_dict:
+        # فشل الحفظ - تبقى التعديلات معلقة
+        st.session_state["edit_pending"] = pending
+        return None
+    try:
+        append_patch_log(PATCH_LOG_FILE, sheet_name, change_set, st.session_state.get("username"), base_sha)
+    except Exception as e:
+        st.warning(f"⚠ لم يتم تسجيل التغييرات في سجل التعديلات: {e}")
+    # محرر جديد بدون تغييرات معلقة
+    st.session_state["editor_rev"] = st.session_state.get("editor_rev", 0) + 1
+    return new_sheets
+
+def autosave_polling_needed():
+    """الفحص الدوري مطلوب لتعديلات معلقة تنتظر الحفظ (وليس لتعارض ينتظر قرار المستخدم)"""
+    pending = st.session_state.get("edit_pending")
+    return bool(pending) and not pending.get("conflict")
+
+def discard_pending_edits():
+    """إلغاء التعديلات المعلقة وإعادة فتح المحرر على الإصدار الحالي"""
+    st.session_state.pop("edit_pending", None)
+    st.session_state["editor_rev"] = st.session_state.get("editor_rev", 0) + 1
+
 # -------------------------------
 # 🧰 دوال مساعدة للمعالجة والنصوص
 # -------------------------------
-def normalize_name(s):
-    if s is None: return ""
-    s = str(s).replace("\n", "+")
-    s = re.sub(r"[^0-9a-zA-Z\u0600-\u06FF\+\s_/.-]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip().lower()
-    return s
-
-def split_needed_services(needed_service_str):
-    if not isinstance(needed_service_str, str) or needed_service_str.strip() == "":
-        return []
-    parts = re.split(r"\+|,|\n|;", needed_service_str)
-    return [p.strip() for p in parts if p.strip() != ""]
-
-def highlight_cell(val, col_name):
-    color_map = {
-        "Service Needed": "background-color: #fff3cd; color:#856404; font-weight:bold;",
-        "Service Done": "background-color: #d4edda; color:#155724; font-weight:bold;",
-        "Service Didn't Done": "background-color: #f8d7da; color:#721c24; font-weight:bold;",
-        "Date": "background-color: #e7f1ff; color:#004085; font-weight:bold;",
-        "Tones": "background-color: #e8f8f5; color:#0d5c4a; font-weight:bold;",
-        "Min_Tons": "background-color: #ebf5fb; color:#154360; font-weight:bold;",
-        "Max_Tons": "background-color: #f9ebea; color:#641e16; font-weight:bold;",
-        "Event": "background-color: #e2f0d9; color:#2e6f32; font-weight:bold;",
-        "Correction": "background-color: #fdebd0; color:#7d6608; font-weight:bold;",
-        "Servised by": "background-color: #f0f0f0; color:#333; font-weight:bold;",
-        "Card Number": "background-color: #ebdef0; color:#4a235a; font-weight:bold;"
-    }
-    return color_map.get(col_name, "")
-
-def style_table(row):
-    return [highlight_cell(row[col], col) for col in row.index]
+# ألوان الأعمدة في جداول النتائج - تطبق على العمود كاملاً مرة واحدة
+COLUMN_STYLES = {
+    "Service Needed": {"background-color": "#fff3cd", "color": "#856404", "font-weight": "bold"},
+    "Service Done": {"background-color": "#d4edda", "color": "#155724", "font-weight": "bold"},
+    "Service Didn't Done": {"background-color": "#f8d7da", "color": "#721c24", "font-weight": "bold"},
+    "Date": {"background-color": "#e7f1ff", "color": "#004085", "font-weight": "bold"},
+    "Tones": {"background-color": "#e8f8f5", "color": "#0d5c4a", "font-weight": "bold"},
+    "Min_Tons": {"background-color": "#ebf5fb", "color": "#154360", "font-weight": "bold"},
+    "Max_Tons": {"background-color": "#f9ebea", "color": "#641e16", "font-weight": "bold"},
+    "Event": {"background-color": "#e2f0d9", "color": "#2e6f32", "font-weight": "bold"},
+    "Correction": {"background-color": "#fdebd0", "color": "#7d6608", "font-weight": "bold"},
+    "Servised by": {"background-color": "#f0f0f0", "color": "#333", "font-weight": "bold"},
+    "Card Number": {"background-color": "#ebdef0", "color": "#4a235a", "font-weight": "bold"},
+}
+
+def style_columns(df):
+    """تلوين الأعمدة المعروفة عموداً عموداً بدلاً من دالة لكل خلية"""
+    styler = df.style
+    for col, props in COLUMN_STYLES.items():
+        if col in df.columns:
+            styler = styler.set_properties(subset=[col], **props)
+    return styler
+
+# -------------------------------
+# 📄 عرض الجداول الكبيرة صفحة بصفحة مع بحث على الخادم
+# -------------------------------
+ALL_COLUMNS_LABEL = "كل الأعمدة"
+
+def filter_rows(df, query, column=None):
+    """الصفوف التي تحتوي على نص البحث (بدون حساسية لحالة الأحرف)"""
+    query = (query or "").strip()
+    if not query:
+        return df
+    columns = [column] if column in df.columns else list(df.columns)
+    mask = pd.Series(False, index=df.index)
+    for col in columns:
+        mask |= df[col].astype(str).str.contains(query, case=False, regex=False, na=False)
+    return df[mask]
+
+def page_bounds(total_rows, key):
+    """اختيار الصفحة وإرجاع حدود الصفوف [start, end)"""
+    page_size = APP_CONFIG["TABLE_PAGE_SIZE"]
+    pages = max(1, -(-total_rows // page_size))
+    if pages == 1:
+        return 0, total_rows
+    page_key = f"{key}_page"
+    # القيمة في session_state فقط (بدون value=) - عدد الصفحات قد يقل بعد البحث أو الحذف
+    if page_key not in st.session_state:
+        st.session_state[page_key] = 1
+    elif st.session_state[page_key] > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input(f"الصفحة (من {pages}):", min_value=1, max_value=pages, step=1, key=page_key)
+    start = (page - 1) * page_size
+    return start, min(start + page_size, total_rows)
+
+def paginated_table(df, key, styled=False, as_text=False):
+    """عرض صفحة واحدة فقط من الجدول بعد البحث - التلوين والتحويل لنص يتم على الصفحة فقط"""
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("🔍 بحث:", key=f"{key}_query")
+    with col2:
+        column = st.selectbox("في العمود:", [ALL_COLUMNS_LABEL] + [str(c) for c in df.columns], key=f"{key}_column")
+    filtered = filter_rows(df, query, None if column == ALL_COLUMNS_LABEL else column)
+
+    start, end = page_bounds(len(filtered), key)
+    page = filtered.iloc[start:end]
+    if as_text:
+        page = page.astype(str)
+    caption = f"الصفوف {min(start + 1, end)}-{end} من {len(filtered)}"
+    if len(filtered) != len(df):
+        caption += f" (بعد البحث من أصل {len(df)})"
+    st.caption(caption)
+    with span("style_render"):
+        st.dataframe(style_columns(page) if styled else page, use_container_width=True)
+    return filtered
 
 def get_user_permissions(user_role, user_permissions):
     """الحصول على صلاحيات المستخدم بناءً على الدور والصلاحيات"""
@@ -480,10 +806,38 @@ def get_user_permissions(user_role, user_permissions):
             "can_see_tech_support": False
         }
 
+# -------------------------------
+# 📥 تنزيل جداول النتائج عند الطلب فقط
+# -------------------------------
+@st.cache_data(show_spinner=False, max_entries=32)
+def cached_table_export(digest, fmt, _df):
+    """ملف التنزيل مخزن حسب بصمة الجدول - لا يعاد إنشاؤه لنفس النتيجة"""
+    return export_table_bytes(_df, fmt)
+
+def download_table_ui(df, file_stem, label, key):
+    """زر تنزيل بصيغة Excel أو CSV - الملف ينشأ في الخلفية عند الضغط فقط"""
+    fmt = st.radio("صيغة الملف:", tuple(EXPORT_FORMATS), horizontal=True, key=f"{key}_format")
+    ext, mime = EXPORT_FORMATS[fmt]
+    perf_history = get_perf_history()
+
+    def build_file():
+        with run_scope(perf_history, "export"), span(f"{fmt}_export"):
+            return cached_table_export(frame_digest(df), fmt, df)
+
+    st.download_button(label=label, data=build_file, file_name=f"{file_stem}.{ext}", mime=mime, key=key)
+
 # -------------------------------
 # 🖥 دالة فحص الماكينة - معدلة لقراءة عمود Event بشكل صحيح
 # -------------------------------
-def check_machine_status(card_num, current_tons, all_sheets):
+VIEW_OPTION_KEYS = {
+    "الشريحة الحالية فقط": "current",
+    "كل الشرائح الأقل": "below",
+    "كل الشرائح الأعلى": "above",
+    "نطاق مخصص": "range",
+    "كل الشرائح": "all",
+}
+
+def check_machine_status(card_num, current_tons, all_sheets, sheet_schemas=None, tonnage_indexes=None):
     if not all_sheets:
         st.error("❌ لم يتم تحميل أي شيتات.")
         return
@@ -508,7 +862,7 @@ def check_machine_status(card_num, current_tons, all_sheets):
     st.subheader("⚙ نطاق العرض")
     view_option = st.radio(
         "اختر نطاق العرض:",
-        ("الشريحة الحالية فقط", "كل الشرائح الأقل", "كل الشرائح الأعلى", "نطاق مخصص", "كل الشرائح"),
+        tuple(VIEW_OPTION_KEYS),
         horizontal=True,
         key="view_option"
     )
@@ -522,193 +876,133 @@ def check_machine_status(card_num, current_tons, all_sheets):
         with col2:
             max_range = st.number_input("إلى (طن):", min_value=min_range, step=100, value=max_range, key="max_range")
 
-    # اختيار الشرائح
-    if view_option == "الشريحة الحالية فقط":
-        selected_slices = service_plan_df[(service_plan_df["Min_Tones"] <= current_tons) & (service_plan_df["Max_Tones"] >= current_tons)]
-    elif view_option == "كل الشرائح الأقل":
-        selected_slices = service_plan_df[service_plan_df["Max_Tones"] <= current_tons]
-    elif view_option == "كل الشرائح الأعلى":
-        selected_slices = service_plan_df[service_plan_df["Min_Tones"] >= current_tons]
-    elif view_option == "نطاق مخصص":
-        selected_slices = service_plan_df[(service_plan_df["Min_Tones"] >= min_range) & (service_plan_df["Max_Tones"] <= max_range)]
-    else:
-        selected_slices = service_plan_df.copy()
+    # اختيار الشرائح عبر الفهرس المرتب لـ ServicePlan
+    tonnage_indexes = tonnage_indexes or {}
+    selected_slices = select_plan_slices(
+        service_plan_df, current_tons, VIEW_OPTION_KEYS[view_option], min_range, max_range,
+        tonnage_indexes.get("ServicePlan")
+    )
 
     if selected_slices.empty:
         st.warning("⚠ لا توجد شرائح مطابقة حسب النطاق المحدد.")
         return
 
-    all_results = []
-    for _, current_slice in selected_slices.iterrows():
-        slice_min = current_slice["Min_Tones"]
-        slice_max = current_slice["Max_Tones"]
-        needed_service_raw = current_slice.get("Service", "")
-        needed_parts = split_needed_services(needed_service_raw)
-        needed_norm = [normalize_name(p) for p in needed_parts]
+    schema = (sheet_schemas or {}).get(card_sheet_name)
+    with span("status_table"):
+        result_df = build_service_status_table(card_num, card_df, selected_slices, schema, tonnage_indexes.get(card_sheet_name))
 
-        mask = (card_df.get("Min_Tones", 0).fillna(0) <= slice_max) & (card_df.get("Max_Tones", 0).fillna(0) >= slice_min)
-        matching_rows = card_df[mask]
+    st.markdown("### 📋 نتائج الفحص - جميع الأحداث")
+    paginated_table(result_df, "status_table", styled=True)
 
-        if not matching_rows.empty:
-            for _, row in matching_rows.iterrows():
-                done_services_set = set()
-                
-                # تحديد الأعمدة التي تحتوي على خدمات منجزة
-                metadata_columns = {
-                    "card", "Tones", "Min_Tones", "Max_Tones", "Date", 
-                    "Other", "Servised by", "Event", "Correction",
-                    "Card", "TONES", "MIN_TONES", "MAX_TONES", "DATE",
-                    "OTHER", "EVENT", "CORRECTION", "SERVISED BY",
-                    "servised by", "Servised By", 
-                    "Serviced by", "Service by", "Serviced By", "Service By",
-                    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
-                }
-                
-                all_columns = set(card_df.columns)
-                service_columns = all_columns - metadata_columns
-                
-                final_service_columns = set()
-                for col in service_columns:
-                    col_normalized = normalize_name(col)
-                    metadata_normalized = {normalize_name(mc) for mc in metadata_columns}
-                    if col_normalized not in metadata_normalized:
-                        final_service_columns.add(col)
-                
-                for col in final_service_columns:
-                    val = str(row.get(col, "")).strip()
-                    if val and val.lower() not in ["nan", "none", "", "null", "0"]:
-                        if val.lower() not in ["no", "false", "not done", "لم تتم", "x", "-"]:
-                            done_services_set.add(col)
-
-                # جمع بيانات الحدث - البحث عن عمود Event بأسماء مختلفة
-                current_date = str(row.get("Date", "")).strip() if pd.notna(row.get("Date")) else "-"
-                current_tones = str(row.get("Tones", "")).strip() if pd.notna(row.get("Tones")) else "-"
-                current_other = str(row.get("Other", "")).strip() if pd.notna(row.get("Other")) else "-"
-                
-                # البحث عن عمود "Event" بأسماء مختلفة
-                event_value = "-"
-                event_columns = [
-                    "Event", "EVENT", "event", "Events", "events",
-                    "الحدث", "الأحداث", "event", "events"
-                ]
-                
-                for potential_col in event_columns:
-                    if potential_col in card_df.columns:
-                        value = row.get(potential_col)
-                        if pd.notna(value) and str(value).strip() != "":
-                            event_value = str(value).strip()
-                            break
-                
-                # إذا لم نجد باسم Event، نبحث بأسماء بديلة
-                if event_value == "-":
-                    for col in card_df.columns:
-                        col_normalized = normalize_name(col)
-                        if col_normalized in ["event", "events", "الحدث", "الأحداث"]:
-                            value = row.get(col)
-                            if pd.notna(value) and str(value).strip() != "":
-                                event_value = str(value).strip()
-                                break
-                
-                # البحث عن عمود "Correction" بأسماء مختلفة
-                correction_value = "-"
-                correction_columns = [
-                    "Correction", "CORRECTION", "correction", "Correct", "correct",
-                    "تصحيح", "تصويب", "تصحيحات", "correction", "correct"
-                ]
-                
-                for potential_col in correction_columns:
-                    if potential_col in card_df.columns:
-                        value = row.get(potential_col)
-                        if pd.notna(value) and str(value).strip() != "":
-                            correction_value = str(value).strip()
-                            break
-                
-                # إذا لم نجد باسم Correction، نبحث بأسماء بديلة
-                if correction_value == "-":
-                    for col in card_df.columns:
-                        col_normalized = normalize_name(col)
-                        if col_normalized in ["correction", "correct", "تصحيح", "تصويب"]:
-                            value = row.get(col)
-                            if pd.notna(value) and str(value).strip() != "":
-                                correction_value = str(value).strip()
-                                break
-                
-                # البحث عن عمود "Servised by"
-                servised_by_value = "-"
-                servised_by_columns = [
-                    "Servised by", "SERVISED BY", "servised by", "Servised By",
-                    "Serviced by", "Service by", "Serviced By", "Service By",
-                    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
-                ]
-                
-                for potential_col in servised_by_columns:
-                    if potential_col in card_df.columns:
-                        value = row.get(potential_col)
-                        if pd.notna(value) and str(value).strip() != "":
-                            servised_by_value = str(value).strip()
-                            break
-                
-                if servised_by_value == "-":
-                    for col in card_df.columns:
-                        col_normalized = normalize_name(col)
-                        if col_normalized in ["servisedby", "servicedby", "serviceby", "خدمبواسطة"]:
-                            value = row.get(col)
-                            if pd.notna(value) and str(value).strip() != "":
-                                servised_by_value = str(value).strip()
-                                break
-
-                done_services = sorted(list(done_services_set))
-                done_norm = [normalize_name(c) for c in done_services]
-                
-                # مقارنة الخدمات المنجزة مع المطلوبة
-                not_done = []
-                for needed_part, needed_norm_part in zip(needed_parts, needed_norm):
-                    if needed_norm_part not in done_norm:
-                        not_done.append(needed_part)
-
-                all_results.append({
-                    "Card Number": card_num,
-                    "Min_Tons": slice_min,
-                    "Max_Tons": slice_max,
-                    "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
-                    "Service Done": ", ".join(done_services) if done_services else "-",
-                    "Service Didn't Done": ", ".join(not_done) if not_done else "-",
-                    "Tones": current_tones,
-                    "Event": event_value,
-                    "Correction": correction_value,
-                    "Servised by": servised_by_value,
-                    "Date": current_date
-                })
-        else:
-            # إذا لم توجد أحداث، نضيف سجل للشريحة بدون خدمات منجزة
-            all_results.append({
-                "Card Number": card_num,
-                "Min_Tons": slice_min,
-                "Max_Tons": slice_max,
-                "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
-                "Service Done": "-",
-                "Service Didn't Done": ", ".join(needed_parts) if needed_parts else "-",
-                "Tones": "-",
-                "Event": "-",
-                "Correction": "-",
-                "Servised by": "-",
-                "Date": "-"
-            })
-
-    result_df = pd.DataFrame(all_results).dropna(how="all").reset_index(drop=True)
+    # تنزيل النتائج - الملف ينشأ فقط عند الضغط على الزر
+    download_table_ui(result_df, f"Service_Report_Card{card_num}", "💾 حفظ النتائج", key="download_status")
 
-    st.markdown("### 📋 نتائج الفحص - جميع الأحداث")
-    st.dataframe(result_df.style.apply(style_table, axis=1), use_container_width=True)
-
-    # تنزيل النتائج
-    buffer = io.BytesIO()
-    result_df.to_excel(buffer, index=False, engine="openpyxl")
-    st.download_button(
-        label="💾 حفظ النتائج كـ Excel",
-        data=buffer.getvalue(),
-        file_name=f"Service_Report_Card{card_num}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# -------------------------------
+# 🏭 تقرير الأسطول - فحص كل الماكينات مرة واحدة
+# -------------------------------
+@st.cache_resource(show_spinner=False)
+def get_fleet_executor():
+    """مجموعة عمليات واحدة لكل عملية خادم (تجنب تكلفة بدء العمليات في كل تقرير)"""
+    return create_fleet_executor(APP_CONFIG["FLEET_WORKERS"])
+
+def fleet_report_ui(all_sheets):
+    st.subheader("🏭 تقرير الأسطول - الخدمات المتأخرة لكل الماكينات")
+    card_sheets = sorted(
+        (card_number_from_sheet(name), name) for name in all_sheets if card_number_from_sheet(name) is not None
     )
+    if not card_sheets or "ServicePlan" not in all_sheets:
+        st.info("لا توجد شيتات ماكينات أو شيت ServicePlan في الملف.")
+        return
+
+    defaults = machine_tonnage_defaults(all_sheets)
+    tonnage_df = pd.DataFrame({
+        "Card Number": [num for num, _ in card_sheets],
+        "Current Tons": [defaults.get(num, 0) for num, _ in card_sheets],
+    })
+    st.caption("عدّل الطن الحالي لكل ماكينة عند الحاجة ثم شغّل التقرير.")
+    tonnage_df = st.data_editor(tonnage_df, hide_index=True, disabled=["Card Number"], key="fleet_tonnage")
+
+    if st.button("تشغيل تقرير الأسطول", key="run_fleet_report"):
+        tons_by_card = dict(zip(tonnage_df["Card Number"], pd.to_numeric(tonnage_df["Current Tons"], errors="coerce").fillna(0)))
+        jobs = [(num, tons_by_card.get(num, 0), all_sheets[name]) for num, name in card_sheets]
+        executor = get_fleet_executor() if len(jobs) >= APP_CONFIG["FLEET_PARALLEL_MIN_CARDS"] else None
+        plan_df = all_sheets["ServicePlan"]
+        with st.spinner("⏳ جاري فحص كل الماكينات..."), span("fleet_report"):
+            try:
+                report = build_fleet_report(plan_df, jobs, executor, APP_CONFIG["FLEET_WORKERS"])
+            except BrokenProcessPool:
+                # توقفت إحدى العمليات - مجموعة جديدة في المرة القادمة والتقرير الحالي بدون توازي
+                get_fleet_executor.clear()
+                st.warning("⚠ توقفت عمليات التقرير المتوازي، تم الفحص بدون توازي.")
+                report = build_fleet_report(plan_df, jobs)
+            st.session_state["fleet_report"] = report
+
+    report = st.session_state.get("fleet_report")
+    if report is None:
+        return
+    st.markdown(f"### 📋 الخدمات المتأخرة ({report['Card Number'].nunique()} ماكينة - {len(report)} سجل)")
+    paginated_table(report, "fleet_table", styled=True)
+    download_table_ui(report, "Fleet_Service_Report", "💾 حفظ تقرير الأسطول", key="download_fleet")
+
+# -------------------------------
+# 🩺 تشخيص الأداء - زمن المراحل لآخر التشغيلات
+# -------------------------------
+def perf_diagnostics_ui():
+    st.markdown("## 🩺 تشخيص الأداء")
+    history = get_perf_history()
+    runs = history.runs()
+    if not runs:
+        st.info("لا توجد تشغيلات مسجلة بعد.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        label = st.selectbox("نوع التشغيل:", sorted({run.label for run in runs}), key="perf_label")
+    with col2:
+        last_n = st.number_input(
+            "عدد التشغيلات الأخيرة:", min_value=1, max_value=APP_CONFIG["PERF_HISTORY_RUNS"],
+            value=min(50, APP_CONFIG["PERF_HISTORY_RUNS"]), step=10, key="perf_last_n"
+        )
+    selected = [run for run in runs if run.label == label][-int(last_n):]
+
+    st.markdown(f"### ⏱ زمن المراحل (ms) - آخر {len(selected)} تشغيل")
+    st.dataframe(summarize_runs(selected), use_container_width=True, hide_index=True)
+
+    hits = sum(run.counters.get("cache_hit", 0) for run in selected)
+    misses = sum(run.counters.get("cache_miss", 0) for run in selected)
+    sheet_cache = get_sheet_cache()
+    st.caption(
+        f"🗃 الكاش في هذه التشغيلات: {hits} hit / {misses} miss — "
+        f"منذ بدء الخادم: {sheet_cache.hits} hit / {sheet_cache.misses} miss — "
+        f"إصدارات مخزنة: {len(sheet_cache.versions())}"
+    )
+
+    recent = pd.DataFrame([
+        {
+            "الوقت": run.started_at.replace("T", " "),
+            "المستخدم": run.user or "-",
+            "الزمن (ms)": round(run.elapsed * 1000, 1),
+            "cache hit": run.counters.get("cache_hit", 0),
+            "cache miss": run.counters.get("cache_miss", 0),
+            "أبطأ مرحلة": max(run.spans, key=lambda name: run.spans[name][1]) if run.spans else "-",
+        }
+        for run in reversed(selected[-20:])
+    ])
+    st.markdown("### 🕒 آخر التشغيلات")
+    st.dataframe(recent, use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="💾 تصدير JSON",
+            data=json.dumps([run.to_dict() for run in selected], indent=2, ensure_ascii=False),
+            file_name=f"perf_{label}.json",
+            mime="application/json"
+        )
+    with col2:
+        if st.button("🗑 مسح سجل الأداء", key="clear_perf_history"):
+            history.clear()
+            st.rerun()
 
 # ===============================
 # 🖥 الواجهة الرئيسية المدمجة
@@ -716,6 +1010,9 @@ def check_machine_status(card_num, current_tons, all_sheets):
 # إعداد الصفحة
 st.set_page_config(page_title=APP_CONFIG["APP_TITLE"], layout="wide")
 
+# بدء قياس زمن هذا التشغيل (ينتهي في آخر السكربت)
+start_run(get_perf_history(), "rerun", st.session_state.get("username"))
+
 # شريط تسجيل الدخول / معلومات الجلسة في الشريط الجانبي
 with st.sidebar:
     st.header("👤 الجلسة")
@@ -723,15 +1020,41 @@ with st.sidebar:
         if not login_ui():
             st.stop()
     else:
-        state = cleanup_sessions(load_state())
         username = st.session_state.username
         user_role = st.session_state.user_role
-        rem = remaining_time(state, username)
+        rem = get_session_store().remaining(username)
         if rem:
             mins, secs = divmod(int(rem.total_seconds()), 60)
             st.success(f"👋 {username} | الدور: {user_role} | ⏳ {mins:02d}:{secs:02d}")
         else:
-            logout_action()
+            logout_action(expired=True)
+
+    # حالة الرفع إلى GitHub في الخلفية
+    sidebar_token = github_token()
+    if sidebar_token and GITHUB_AVAILABLE:
+        push_status = get_push_worker(sidebar_token).status()
+        if push_status["state"] == "retrying":
+            st.warning(f"📤 فشل الرفع، إعادة المحاولة ({push_status['attempts']}) - معلق: {push_status['pending']}\n\n{push_status['last_error']}")
+        elif push_status["pending"]:
+            st.info(f"📤 جاري الرفع إلى GitHub - معلق: {push_status['pending']}")
+        elif push_status["last_success"]:
+            st.caption(f"📤 آخر رفع ناجح: {push_status['last_success'][:19].replace('T', ' ')}")
+
+    # مزامنة الملف من GitHub في الخلفية
+    sync_status = get_sync_service(sidebar_token).status()
+    if sync_status["last_check"]:
+        st.caption(f"🔄 آخر فحص لتحديثات GitHub: {sync_status['last_check'][11:19]}")
+    if "seen_sync_update" not in st.session_state:
+        st.session_state["seen_sync_update"] = sync_status["last_update"]
+    elif sync_status["last_update"] != st.session_state["seen_sync_update"]:
+        st.toast("🔔 تم تحديث ملف البيانات من GitHub")
+        st.session_state["seen_sync_update"] = sync_status["last_update"]
+    if sync_status["diverged"]:
+        st.warning("⚠ نسخة GitHub تغيرت والملف المحلي فيه تعديلات لم تتم مزامنتها - لم يتم استبداله تلقائياً.")
+
+    pending_edit = st.session_state.get("edit_pending")
+    if pending_edit:
+        st.caption(f"📝 تغييرات غير محفوظة في {pending_edit['sheet']}: {pending_edit['changes']}")
 
     st.markdown("---")
     st.write("🔧 أدوات:")
@@ -739,10 +1062,11 @@ with st.sidebar:
         if fetch_from_github_requests():
             st.rerun()
     
-    # زر مسح الكاش
+    # زر مسح الكاش - يمسح كاش الإصدار الحالي من الملف فقط
     if st.button("🗑 مسح الكاش"):
         try:
-            st.cache_data.clear()
+            invalidate_workbook_version(current_workbook_sha())
+            workbook_sha256.clear()
             st.rerun()
         except Exception as e:
             st.error(f"❌ خطأ في مسح الكاش: {e}")
@@ -758,6 +1082,11 @@ all_sheets = load_all_sheets()
 # تحميل الشيتات للتحرير (dtype=object)
 sheets_edit = load_sheets_for_edit()
 
+# أدوار الأعمدة لكل شيت (تستخدم في الفحص والتحرير)
+sheet_schemas = load_sheet_schemas()
+tonnage_indexes = load_tonnage_indexes()
+row_insert_indexes = load_row_insert_indexes()
+
 # واجهة التبويبات الرئيسية
 st.title(f"{APP_CONFIG['APP_ICON']} {APP_CONFIG['APP_TITLE']}")
 
@@ -794,7 +1123,10 @@ with tabs[0]:
             st.session_state["show_results"] = True
 
         if st.session_state.get("show_results", False):
-            check_machine_status(card_num, current_tons, all_sheets)
+            check_machine_status(card_num, current_tons, all_sheets, sheet_schemas, tonnage_indexes)
+
+        st.markdown("---")
+        fleet_report_ui(all_sheets)
 
 # -------------------------------
 # Tab: تعديل وإدارة البيانات - للمحررين والمسؤولين فقط
@@ -804,42 +1136,100 @@ if permissions["can_edit"] and len(tabs) > 1:
         st.header("🛠 تعديل وإدارة البيانات")
 
         # تحقق صلاحية الرفع
-        token_exists = bool(st.secrets.get("github", {}).get("token", None))
+        token_exists = bool(github_token())
         can_push = token_exists and GITHUB_AVAILABLE
 
         if sheets_edit is None:
             st.warning("❗ الملف المحلي غير موجود. اضغط تحديث من GitHub في الشريط الجانبي أولًا.")
         else:
-            tab1, tab2, tab3, tab4 = st.tabs([
+            tab1, tab2, tab3, tab4, tab5 = st.tabs([
                 "عرض وتعديل شيت",
                 "إضافة صف جديد", 
                 "إضافة عمود جديد",
-                "🗑 حذف صف"
+                "🗑 حذف صف",
+                "📥 استيراد أحداث"
             ])
 
             # -------------------------------
-            # Tab 1: تعديل بيانات وعرض - معدل للحفظ التلقائي
+            # Tab 1: تعديل بيانات وعرض - حفظ مؤجل يجمع التعديلات
             # -------------------------------
-            with tab1:
+            # فحص الحفظ التلقائي الدوري فقط أثناء وجود تعديلات معلقة
+            autosave_polling = autosave_polling_needed()
+
+            @st.fragment(run_every=APP_CONFIG["AUTOSAVE_CHECK_SECONDS"] if autosave_polling else None)
+            def edit_sheet_tab():
+                with run_scope(get_perf_history(), "edit_fragment", st.session_state.get("username")):
+                    _edit_sheet_tab_body()
+                if autosave_polling_needed() != autosave_polling:
+                    # بدء أو إيقاف الفحص الدوري يتطلب إعادة تعريف الـ fragment
+                    st.rerun()
+
+            def _edit_sheet_tab_body():
                 st.subheader("✏ تعديل البيانات")
                 sheet_name = st.selectbox("اختر الشيت:", list(sheets_edit.keys()), key="edit_sheet")
-                df = sheets_edit[sheet_name].astype(str)
 
-                # استخدام data_editor مع التعديل التلقائي
-                edited_df = st.data_editor(df, num_rows="dynamic", use_container_width=True, 
-                                         key=f"editor_{sheet_name}")
-                
-                # حفظ تلقائي عند التعديل
-                if not edited_df.equals(df):
-                    st.info("🔄 يتم حفظ التغييرات تلقائياً...")
-                    sheets_edit[sheet_name] = edited_df.astype(object)
-                    new_sheets = auto_save_to_github(
-                        sheets_edit, 
-                        f"تعديل تلقائي في شيت {sheet_name}"
+                # المحرر يعرض صفحة واحدة من الشيت فقط
+                full_df = sheets_edit[sheet_name]
+                start, end = page_bounds(len(full_df), f"editor_{sheet_name}")
+
+                # عند تغيير الشيت أو الصفحة تحفظ تعديلات السابقة أولاً
+                pending = st.session_state.get("edit_pending")
+                if pending and (pending["sheet"] != sheet_name or pending["start"] != start):
+                    if flush_pending_edits(sheets_edit) is not None:
+                        st.rerun()
+                    pending = st.session_state.get("edit_pending")
+
+                # تعارض مع إصدار أحدث من الملف - لا حفظ تلقائي حتى يقرر المستخدم
+                if pending and pending.get("conflict"):
+                    st.error(
+                        f"⚠ تم تعديل شيت {pending['sheet']} من جلسة أخرى أو من GitHub بعد فتح المحرر. "
+                        f"تغييراتك المعلقة ({pending['changes']}) لم تحفظ حتى لا تكتب في صفوف خاطئة."
                     )
-                    if new_sheets is not None:
-                        sheets_edit = new_sheets
+                    st.json(pending["change_set"], expanded=False)
+                    if st.button("🗑 تجاهل تغييراتي وفتح النسخة الحالية", key="discard_pending_edits"):
+                        discard_pending_edits()
                         st.rerun()
+                    return
+
+                # فشل حفظ تعديلات صفحة أخرى - لا تفتح صفحة جديدة حتى لا تضيع
+                if pending and (pending["sheet"] != sheet_name or pending["start"] != start):
+                    st.warning(f"⚠ تغييرات {pending['sheet']} المعلقة ({pending['changes']}) لم تحفظ بعد.")
+                    st.button("🔁 إعادة محاولة الحفظ", key="retry_pending_edits")
+                    return
+
+                with span("editor_prepare"):
+                    df = full_df.iloc[start:end].astype(str)
+                editor_key = f"editor_{sheet_name}_{start}_{st.session_state.get('editor_rev', 0)}"
+                with span("editor_render"):
+                    st.data_editor(df, num_rows="dynamic", use_container_width=True, key=editor_key)
+
+                # التغييرات فقط (وليس الصفحة كاملة) بمواضعها في الشيت
+                change_set = editor_change_set(st.session_state.get(editor_key), full_df, start, end)
+                changes = change_set_size(change_set)
+                if not changes:
+                    st.session_state.pop("edit_pending", None)
+                    return
+
+                if pending and pending["sheet"] == sheet_name:
+                    since, base = pending["since"], {"base": pending["base"], "base_digest": pending["base_digest"]}
+                else:
+                    since, base = time.time(), pending_edit_base(sheets_edit, sheet_name)
+                st.session_state["edit_pending"] = {
+                    "sheet": sheet_name, "start": start, "end": end,
+                    "change_set": change_set, "changes": changes, "since": since, **base
+                }
+
+                wait_seconds = APP_CONFIG["AUTOSAVE_DEBOUNCE_SECONDS"] - (time.time() - since)
+                st.info(f"📝 تغييرات غير محفوظة: {changes} — سيتم الحفظ تلقائياً خلال {max(0, int(wait_seconds))} ثانية")
+                commit_now = st.button("💾 حفظ ورفع التغييرات الآن", key="commit_pending_edits")
+
+                if commit_now or wait_seconds <= 0:
+                    st.info("🔄 يتم حفظ التغييرات...")
+                    if flush_pending_edits(sheets_edit) is not None:
+                        st.rerun()
+
+            with tab1:
+                edit_sheet_tab()
 
             # -------------------------------
             # Tab 2: إضافة صف جديد - معدل للحفظ التلقائي
@@ -847,7 +1237,7 @@ if permissions["can_edit"] and len(tabs) > 1:
             with tab2:
                 st.subheader("➕ إضافة صف جديد")
                 sheet_name_add = st.selectbox("اختر الشيت لإضافة صف:", list(sheets_edit.keys()), key="add_sheet")
-                df_add = sheets_edit[sheet_name_add].astype(str).reset_index(drop=True)
+                df_add = sheets_edit[sheet_name_add]
                 
                 st.markdown("أدخل بيانات الحدث:")
 
@@ -860,90 +1250,31 @@ if permissions["can_edit"] and len(tabs) > 1:
                 if st.button("💾 إضافة الصف الجديد", key=f"add_row_{sheet_name_add}"):
                     new_row_df = pd.DataFrame([new_data]).astype(str)
 
-                    # البحث عن أعمدة الرينج
-                    min_col, max_col, card_col = None, None, None
-                    for c in df_add.columns:
-                        c_low = c.strip().lower()
-                        if c_low in ("min_tones", "min_tone", "min tones", "min"):
-                            min_col = c
-                        if c_low in ("max_tones", "max_tone", "max tones", "max"):
-                            max_col = c
-                        if c_low in ("card", "machine", "machine_no", "machine id"):
-                            card_col = c
+                    # أعمدة الرينج من مخطط الشيت
+                    schema_add = sheet_schemas.get(sheet_name_add) or resolve_sheet_schema(df_add)
+                    min_col, max_col = schema_add["min_tones"], schema_add["max_tones"]
 
                     if not min_col or not max_col:
                         st.error("⚠ لم يتم العثور على أعمدة Min_Tones و/أو Max_Tones في الشيت.")
                     else:
-                        def to_num_or_none(x):
-                            try:
-                                return float(x)
-                            except:
-                                return None
-
                         new_min_raw = str(new_data.get(min_col, "")).strip()
                         new_max_raw = str(new_data.get(max_col, "")).strip()
-                        new_min_num = to_num_or_none(new_min_raw)
-                        new_max_num = to_num_or_none(new_max_raw)
-
-                        # البحث عن موضع الإدراج
-                        insert_pos = len(df_add)
-                        mask = pd.Series([False] * len(df_add))
-
-                        if card_col:
-                            new_card = str(new_data.get(card_col, "")).strip()
-                            if new_card != "":
-                                if new_min_num is not None and new_max_num is not None:
-                                    mask = (
-                                        (df_add[card_col].astype(str).str.strip() == new_card) &
-                                        (pd.to_numeric(df_add[min_col], errors='coerce') == new_min_num) &
-                                        (pd.to_numeric(df_add[max_col], errors='coerce') == new_max_num)
-                                    )
-                                else:
-                                    mask = (
-                                        (df_add[card_col].astype(str).str.strip() == new_card) &
-                                        (df_add[min_col].astype(str).str.strip() == new_min_raw) &
-                                        (df_add[max_col].astype(str).str.strip() == new_max_raw)
-                                    )
-                        else:
-                            if new_min_num is not None and new_max_num is not None:
-                                mask = (
-                                    (pd.to_numeric(df_add[min_col], errors='coerce') == new_min_num) &
-                                    (pd.to_numeric(df_add[max_col], errors='coerce') == new_max_num)
-                                )
-                            else:
-                                mask = (
-                                    (df_add[min_col].astype(str).str.strip() == new_min_raw) &
-                                    (df_add[max_col].astype(str).str.strip() == new_max_raw)
-                                )
-
-                        if mask.any():
-                            insert_pos = mask[mask].index[-1] + 1
-                        else:
-                            try:
-                                df_add["_min_num"] = pd.to_numeric(df_add[min_col], errors='coerce').fillna(-1)
-                                if new_min_num is not None:
-                                    insert_pos = int((df_add["_min_num"] < new_min_num).sum())
-                                else:
-                                    insert_pos = len(df_add)
-                                df_add = df_add.drop(columns=["_min_num"])
-                            except Exception:
-                                insert_pos = len(df_add)
-
-                        df_top = df_add.iloc[:insert_pos].reset_index(drop=True)
-                        df_bottom = df_add.iloc[insert_pos:].reset_index(drop=True)
-                        df_new = pd.concat(
-                            [df_top, new_row_df.reset_index(drop=True), df_bottom],
-                            ignore_index=True
-                        )
 
-                        sheets_edit[sheet_name_add] = df_new.astype(object)
+                        # موضع الإدراج بالبحث الثنائي في مفاتيح الأطنان المرتبة للشيت
+                        with span("sorted_insert"):
+                            df_new, insert_index = merge_sorted_rows(
+                                df_add, new_row_df, schema_add, row_insert_indexes.get(sheet_name_add)
+                            )
+                        sheets_edit[sheet_name_add] = df_new
 
                         # حفظ تلقائي في GitHub
                         new_sheets = auto_save_to_github(
                             sheets_edit,
                             f"إضافة صف جديد في {sheet_name_add} بالرينج {new_min_raw}-{new_max_raw}"
                         )
-                        if new_sheets is not None:
+                        if new_sheets is not sheets_edit:
+                            # المفاتيح المحدثة تستخدم للإصدار الجديد بدون إعادة بنائها
+                            get_sheet_cache().put(current_workbook_sha(), ("row_insert_index", sheet_name_add), insert_index)
                             sheets_edit = new_sheets
                             st.rerun()
 
@@ -953,22 +1284,21 @@ if permissions["can_edit"] and len(tabs) > 1:
             with tab3:
                 st.subheader("🆕 إضافة عمود جديد")
                 sheet_name_col = st.selectbox("اختر الشيت لإضافة عمود:", list(sheets_edit.keys()), key="add_col_sheet")
-                df_col = sheets_edit[sheet_name_col].astype(str)
+                df_col = sheets_edit[sheet_name_col]
                 
                 new_col_name = st.text_input("اسم العمود الجديد:")
                 default_value = st.text_input("القيمة الافتراضية لكل الصفوف (اختياري):", "")
 
                 if st.button("💾 إضافة العمود الجديد", key=f"add_col_{sheet_name_col}"):
                     if new_col_name:
-                        df_col[new_col_name] = default_value
-                        sheets_edit[sheet_name_col] = df_col.astype(object)
+                        sheets_edit[sheet_name_col] = df_col.assign(**{new_col_name: default_value}).astype(object)
                         
                         # حفظ تلقائي في GitHub
                         new_sheets = auto_save_to_github(
                             sheets_edit,
                             f"إضافة عمود جديد '{new_col_name}' إلى {sheet_name_col}"
                         )
-                        if new_sheets is not None:
+                        if new_sheets is not sheets_edit:
                             sheets_edit = new_sheets
                             st.rerun()
                     else:
@@ -980,10 +1310,10 @@ if permissions["can_edit"] and len(tabs) > 1:
             with tab4:
                 st.subheader("🗑 حذف صف من الشيت")
                 sheet_name_del = st.selectbox("اختر الشيت:", list(sheets_edit.keys()), key="delete_sheet")
-                df_del = sheets_edit[sheet_name_del].astype(str).reset_index(drop=True)
+                df_del = sheets_edit[sheet_name_del].reset_index(drop=True)
 
                 st.markdown("### 📋 بيانات الشيت الحالية")
-                st.dataframe(df_del, use_container_width=True)
+                paginated_table(df_del, f"delete_{sheet_name_del}", as_text=True)
 
                 st.markdown("### ✏ اختر الصفوف التي تريد حذفها")
                 rows_to_delete = st.text_input("أدخل أرقام الصفوف مفصولة بفاصلة (مثلاً: 0,2,5):")
@@ -1010,12 +1340,75 @@ if permissions["can_edit"] and len(tabs) > 1:
                                     sheets_edit, 
                                     f"حذف الصفوف {rows_list} من {sheet_name_del}"
                                 )
-                                if new_sheets is not None:
+                                if new_sheets is not sheets_edit:
                                     sheets_edit = new_sheets
                                     st.rerun()
                         except Exception as e:
                             st.error(f"حدث خطأ أثناء الحذف: {e}")
 
+            # -------------------------------
+            # Tab 5: استيراد أحداث من ملف CSV / Excel - حفظ واحد و commit واحد
+            # -------------------------------
+            with tab5:
+                st.subheader("📥 استيراد أحداث لعدة ماكينات")
+                st.caption(
+                    "الأعمدة المطلوبة: card (رقم الماكينة) و Min_Tones و Max_Tones — "
+                    "باقي الأعمدة يجب أن تكون موجودة في شيت الماكينة (Event, Date, الخدمات, ...)."
+                )
+                import_rev = st.session_state.get("bulk_import_rev", 0)
+                uploaded = st.file_uploader(
+                    "اختر ملف الأحداث:", type=list(IMPORT_EXTENSIONS), key=f"bulk_import_file_{import_rev}"
+                )
+
+                if uploaded is not None:
+                    try:
+                        import_df = read_import_table(uploaded.name, uploaded.getvalue())
+                    except Exception as e:
+                        import_df = None
+                        st.error(f"❌ تعذر قراءة الملف: {e}")
+
+                    if import_df is not None:
+                        with span("bulk_import_validate"):
+                            rows_by_sheet, import_errors = plan_bulk_import(import_df, sheets_edit, sheet_schemas)
+
+                        if import_errors:
+                            st.error(f"❌ لا يمكن الاستيراد - {len(import_errors)} خطأ في الملف:")
+                            st.markdown("\n".join(f"- {e}" for e in import_errors[:50]))
+                            if len(import_errors) > 50:
+                                st.caption(f"... و {len(import_errors) - 50} خطأ آخر")
+                        else:
+                            st.success(f"✅ {len(import_df)} حدث صالح لـ {len(rows_by_sheet)} ماكينة")
+                            st.dataframe(
+                                pd.DataFrame({"الشيت": list(rows_by_sheet), "عدد الأحداث": [len(r) for r in rows_by_sheet.values()]}),
+                                use_container_width=True, hide_index=True
+                            )
+                            paginated_table(import_df, "bulk_import_preview", as_text=True)
+
+                            if st.session_state.get("edit_pending"):
+                                st.warning("⚠ توجد تغييرات غير محفوظة في المحرر - احفظها أولاً قبل الاستيراد.")
+                            elif st.button("💾 استيراد كل الأحداث", key="bulk_import_commit"):
+                                # كل الصفوف تدمج في مواضعها (تمريرة واحدة لكل شيت) ثم حفظ واحد و commit واحد
+                                updated_indexes = {}
+                                with span("bulk_import_merge"):
+                                    for sheet_name_imp, new_rows in rows_by_sheet.items():
+                                        sheets_edit[sheet_name_imp], updated_indexes[sheet_name_imp] = merge_sorted_rows(
+                                            sheets_edit[sheet_name_imp], new_rows,
+                                            sheet_schemas[sheet_name_imp], row_insert_indexes.get(sheet_name_imp)
+                                        )
+
+                                new_sheets = auto_save_to_github(
+                                    sheets_edit,
+                                    f"استيراد {len(import_df)} حدث في {len(rows_by_sheet)} شيت من {uploaded.name}"
+                                )
+                                if new_sheets is not sheets_edit:
+                                    new_sha = current_workbook_sha()
+                                    for sheet_name_imp, insert_index in updated_indexes.items():
+                                        get_sheet_cache().put(new_sha, ("row_insert_index", sheet_name_imp), insert_index)
+                                    # ملف جديد فارغ حتى لا يستورد نفس الملف مرتين
+                                    st.session_state["bulk_import_rev"] = import_rev + 1
+                                    sheets_edit = new_sheets
+                                    st.rerun()
+
 # -------------------------------
 # Tab: إدارة المستخدمين - للمسؤول فقط
 # -------------------------------
@@ -1061,18 +1454,11 @@ if permissions["can_manage_users"] and len(tabs) > 2:
             elif new_username in users:
                 st.warning("⚠ هذا المستخدم موجود بالفعل.")
             else:
-                # تحديد الصلاحيات بناءً على الدور
-                if user_role == "admin":
-                    permissions_list = ["all"]
-                elif user_role == "editor":
-                    permissions_list = ["view", "edit"]
-                else:  # viewer
-                    permissions_list = ["view"]
-                
                 users[new_username] = {
-                    "password": new_password,
+                    "password": hash_password(new_password),
                     "role": user_role,
-                    "permissions": permissions_list,
+                    # تحديد الصلاحيات بناءً على الدور
+                    "permissions": list(ROLE_PERMISSIONS[user_role]),
                     "created_at": datetime.now().isoformat()
                 }
                 if save_users(users):
@@ -1129,7 +1515,7 @@ if permissions["can_manage_users"] and len(tabs) > 2:
                 if not new_password_reset.strip():
                     st.warning("⚠ الرجاء إدخال كلمة المرور الجديدة.")
                 else:
-                    users[user_to_reset]["password"] = new_password_reset
+                    users[user_to_reset]["password"] = hash_password(new_password_reset)
                     if save_users(users):
                         st.success(f"✅ تم إعادة تعيين كلمة المرور للمستخدم '{user_to_reset}' بنجاح.")
                         st.rerun()
@@ -1172,3 +1558,10 @@ if ((permissions["can_manage_users"] and len(tabs) > 3) or
         st.markdown("- النظام: نظام سيرفيس كرد ترتشلر")
         
         st.info("ملاحظة: في حالة مواجهة أي مشاكل تقنية أو تحتاج إلى إضافة ميزات جديدة، يرجى التواصل مع قسم الدعم الفني.")
+
+        # تشخيص الأداء - للمسؤول فقط
+        if permissions["can_manage_users"]:
+            st.markdown("---")
+            perf_diagnostics_ui()
+
+finish_run()
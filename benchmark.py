@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from service_engine import (
+    build_fleet_report,
+    build_service_status_table,
+    card_number_from_sheet,
+    create_fleet_executor,
+    machine_tonnage_defaults,
+    select_plan_slices,
+)
+from workbook_store import (
+    VersionedSheetCache,
+    editor_change_set,
+    open_workbook,
+    patch_workbook_atomic,
+    write_workbook_atomic,
+)
+
+# ===============================
+# ⏱ قياس أداء التحميل والفحص والحفظ على ملفات اصطناعية
+# ===============================
+# مثال:
+#   python benchmark.py --cards 24 100 --events 12 500 --repeat 3 --output bench.json
+
+SERVICE_NAMES = [
+    "Revolving flats(X)", "1.carding elemnt(o)", "licker_in carding element(o)",
+    "Doffer carding element(o)", "cylinder(X)", "doffer(X)", "Revolving flats(o)",
+    "first licker_in roll(o)",
+]
+SLICE_WIDTH = 150
+
+def build_service_plan(slices, rng):
+    """شيت ServicePlan بشرائح متتالية وخدمات عشوائية"""
+    mins = np.arange(slices) * SLICE_WIDTH + np.where(np.arange(slices) == 0, 0, 1)
+    maxs = (np.arange(slices) + 1) * SLICE_WIDTH
+    services = ["no_service"] + [
+        "+".join(rng.choice(SERVICE_NAMES, size=rng.integers(1, 4), replace=False))
+        for _ in range(slices - 1)
+    ]
+    return pd.DataFrame({"Min_Tones": mins, "Max_Tones": maxs, "Service": services})
+
+def build_card_sheet(card_num, events, plan_df, rng):
+    """شيت Card بأحداث موزعة على الشرائح وعلامات ✔ للخدمات المنجزة"""
+    rows = rng.integers(0, len(plan_df), size=events)
+    sheet = pd.DataFrame({
+        "card": card_num,
+        "Min_Tones": plan_df["Min_Tones"].to_numpy()[rows],
+        "Max_Tones": plan_df["Max_Tones"].to_numpy()[rows],
+        "Tones": plan_df["Min_Tones"].to_numpy()[rows] + rng.integers(0, SLICE_WIDTH, size=events),
+    })
+    for name in SERVICE_NAMES:
+        sheet[name] = np.where(rng.random(events) < 0.3, "✔", None)
+    sheet["Date"] = [f"{d}\\{m}\\2024" for d, m in zip(rng.integers(1, 29, events), rng.integers(1, 13, events))]
+    sheet["Event"] = np.where(rng.random(events) < 0.5, "زياره توكيل", None)
+    sheet["Correction"] = np.where(rng.random(events) < 0.2, "اعاده عيار ماكينه", None)
+    sheet["Serviced by"] = rng.choice(["حسام", "زكريا", "م.صيام"], size=events)
+    return sheet.sort_values("Min_Tones", kind="stable").reset_index(drop=True)
+
+def build_synthetic_workbook(path, cards, events, slices=40, seed=0):
+    """إنشاء ملف بنفس شكل Machine_Service_Lookup: ServicePlan + Machine + N شيت Card × M حدث"""
+    rng = np.random.default_rng(seed)
+    plan_df = build_service_plan(slices, rng)
+    machine_df = pd.DataFrame({
+        "card": np.arange(1, cards + 1),
+        "Current_Tones": rng.integers(0, slices * SLICE_WIDTH, size=cards),
+    })
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for card_num in range(1, cards + 1):
+            build_card_sheet(card_num, events, plan_df, rng).to_excel(writer, sheet_name=f"Card{card_num}", index=False)
+        machine_df.to_excel(writer, sheet_name="Machine", index=False)
+        plan_df.to_excel(writer, sheet_name="ServicePlan", index=False)
+
+def load_everything(workbook):
+    """تحميل كل الشيتات مع المخطط والفهرس كما يفعل التطبيق عند فحص الأسطول"""
+    for name in workbook.sheet_names():
+        workbook.typed(name)
+        workbook.schema(name)
+        workbook.tonnage_index(name)
+
+def time_runs(func, repeat, setup=None):
+    """تشغيل الدالة عدة مرات وإرجاع الأزمنة بالثواني"""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {
+        "runs": runs,
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "max": max(runs),
+    }
+
+def bench_case(folder, cards, events, repeat, workers):
+    """قياس كل المسارات لملف واحد بحجم محدد"""
+    path = os.path.join(folder, f"bench_{cards}x{events}.xlsx")
+    sidecar_dir = os.path.join(folder, f"sidecar_{cards}x{events}")
+    build_synthetic_workbook(path, cards, events)
+    timings = {}
+
+    # تحميل بارد: بدون مخزن في الذاكرة وبدون نسخة سريعة على القرص
+    timings["cold_load"] = time_runs(
+        lambda: load_everything(open_workbook(path, sidecar_dir=sidecar_dir)), repeat,
+        setup=lambda: shutil.rmtree(sidecar_dir, ignore_errors=True)
+    )
+    # تحميل من النسخة السريعة على القرص (بعد إعادة تشغيل الخادم)
+    timings["sidecar_load"] = time_runs(lambda: load_everything(open_workbook(path, sidecar_dir=sidecar_dir)), repeat)
+    # تحميل دافئ: كل شيء في المخزن المشترك
+    cache = VersionedSheetCache(1)
+    workbook = open_workbook(path, cache, sidecar_dir)
+    load_everything(workbook)
+    timings["warm_load"] = time_runs(lambda: load_everything(open_workbook(path, cache, sidecar_dir)), repeat)
+
+    sheets = workbook.lazy(workbook.typed)
+    plan_df = sheets["ServicePlan"]
+    plan_index = workbook.tonnage_index("ServicePlan")
+    tons_by_card = machine_tonnage_defaults(sheets)
+    card_sheets = sorted((card_number_from_sheet(n), n) for n in sheets if card_number_from_sheet(n) is not None)
+
+    def single_check(view):
+        card_num, sheet_name = card_sheets[0]
+        selected = select_plan_slices(plan_df, tons_by_card.get(card_num, 0), view, plan_index=plan_index)
+        build_service_status_table(
+            card_num, sheets[sheet_name], selected, workbook.schema(sheet_name), workbook.tonnage_index(sheet_name)
+        )
+
+    timings["single_check_current"] = time_runs(lambda: single_check("current"), repeat)
+    timings["single_check_all"] = time_runs(lambda: single_check("all"), repeat)
+
+    jobs = [(num, tons_by_card.get(num, 0), sheets[name]) for num, name in card_sheets]
+    timings["fleet_check"] = time_runs(lambda: build_fleet_report(plan_df, jobs), repeat)
+    if workers and workers > 1:
+        executor = create_fleet_executor(workers)
+        try:
+            build_fleet_report(plan_df, jobs, executor, workers)  # تشغيل العمليات قبل القياس
+            timings["fleet_check_parallel"] = time_runs(lambda: build_fleet_report(plan_df, jobs, executor, workers), repeat)
+        finally:
+            executor.shutdown()
+
+    # حفظ خلية واحدة معدلة (مثل تعديل من واجهة التحرير) ثم شيت واحد كامل ثم الملف بالكامل
+    edit_sheets = workbook.lazy(workbook.for_edit)
+    first_card = card_sheets[0][1]
+    cell_patch = editor_change_set({"edited_rows": {0: {"Tones": "1"}}}, edit_sheets[first_card])
+    timings["save_cell_patch"] = time_runs(lambda: patch_workbook_atomic(path, {first_card: cell_patch}), repeat)
+    edit_sheets[first_card] = edit_sheets[first_card]
+    timings["save_dirty_sheet"] = time_runs(
+        lambda: write_workbook_atomic(path, edit_sheets, edit_sheets.dirty_sheets()), repeat
+    )
+    all_edit_sheets = {name: edit_sheets[name] for name in edit_sheets}
+    timings["save_full"] = time_runs(lambda: write_workbook_atomic(path, all_edit_sheets), repeat)
+
+    return {
+        "cards": cards,
+        "events": events,
+        "file_bytes": os.path.getsize(path),
+        "timings": timings,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="قياس أداء التحميل والفحص والحفظ")
+    parser.add_argument("--cards", type=int, nargs="+", default=[24], help="أعداد شيتات Card")
+    parser.add_argument("--events", type=int, nargs="+", default=[12, 200], help="عدد الأحداث في كل شيت")
+    parser.add_argument("--repeat", type=int, default=3, help="عدد مرات تكرار كل قياس")
+    parser.add_argument("--workers", type=int, help="عدد العمليات لقياس تقرير الأسطول المتوازي")
+    parser.add_argument("--output", help="حفظ النتائج JSON في ملف بدلاً من الطباعة")
+    parser.add_argument("--keep", help="مجلد لحفظ الملفات الاصطناعية بدلاً من مجلد مؤقت")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    folder = args.keep or tempfile.mkdtemp(prefix="service_bench_")
+    os.makedirs(folder, exist_ok=True)
+    try:
+        cases = [
+            bench_case(folder, cards, events, args.repeat, args.workers)
+            for cards in args.cards for events in args.events
+        ]
+    finally:
+        if not args.keep:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+# ===============================
+# ⏱ قياس زمن المراحل لكل تشغيل (بدون Streamlit)
+# ===============================
+# كل خيط له تشغيل نشط واحد (تشغيل السكربت أو عملية رفع في الخلفية)؛
+# span و count لا تفعل شيئاً إذا لم يكن هناك تشغيل نشط.
+_active = threading.local()
+
+class PerfRun:
+    """سجل زمن المراحل وعدادات الكاش لتشغيل واحد"""
+
+    def __init__(self, label, user=None):
+        self.label = label
+        self.user = user
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self.elapsed = 0.0
+        self.spans = {}
+        self.counters = {}
+
+    def add_span(self, name, seconds):
+        count, total = self.spans.get(name, (0, 0.0))
+        self.spans[name] = (count + 1, total + seconds)
+        self.touch()
+
+    def add_count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def touch(self):
+        """تحديث الزمن الكلي (يبقى صحيحاً تقريباً حتى لو توقف السكربت بـ st.stop أو st.rerun)"""
+        self.elapsed = time.perf_counter() - self._start
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "user": self.user,
+            "started_at": self.started_at,
+            "elapsed_ms": round(self.elapsed * 1000, 3),
+            "spans": {name: {"count": c, "ms": round(t * 1000, 3)} for name, (c, t) in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+
+class PerfHistory:
+    """آخر N تشغيلات (مشتركة بين الجلسات)"""
+
+    def __init__(self, max_runs):
+        self._runs = deque(maxlen=max_runs)
+        self._lock = threading.Lock()
+
+    def add(self, run):
+        with self._lock:
+            self._runs.append(run)
+
+    def runs(self, last=None):
+        with self._lock:
+            runs = list(self._runs)
+        return runs[-last:] if last else runs
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+
+def start_run(history, label, user=None):
+    """بدء تشغيل جديد لهذا الخيط وإضافته للسجل مباشرة"""
+    run = PerfRun(label, user)
+    _active.run = run
+    history.add(run)
+    return run
+
+def finish_run():
+    """إنهاء تشغيل هذا الخيط"""
+    run = getattr(_active, "run", None)
+    if run is not None:
+        run.touch()
+        _active.run = None
+    return run
+
+@contextmanager
+def run_scope(history, label, user=None):
+    """تشغيل مستقل (مثل إعادة تشغيل fragment وحده) فقط إذا لم يكن هناك تشغيل نشط"""
+    if getattr(_active, "run", None) is not None:
+        yield
+        return
+    start_run(history, label, user)
+    try:
+        yield
+    finally:
+        finish_run()
+
+@contextmanager
+def span(name):
+    """قياس زمن مرحلة داخل التشغيل النشط"""
+    run = getattr(_active, "run", None)
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.add_span(name, time.perf_counter() - start)
+
+def count(name, n=1):
+    """زيادة عداد (مثل cache_hit) في التشغيل النشط"""
+    run = getattr(_active, "run", None)
+    if run is not None:
+        run.add_count(name, n)
+
+def summarize_runs(runs, percentiles=(0.5, 0.9, 0.99)):
+    """جدول النسب المئوية (ms) لكل مرحلة عبر التشغيلات"""
+    rows = [("total", run.elapsed * 1000) for run in runs]
+    rows += [(name, total * 1000) for run in runs for name, (_, total) in run.spans.items()]
+    columns = ["span", "runs"] + [f"p{int(p * 100)}_ms" for p in percentiles] + ["max_ms"]
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    df = pd.DataFrame(rows, columns=["span", "ms"])
+    grouped = df.groupby("span", sort=False)["ms"]
+    summary = pd.DataFrame({"runs": grouped.size()})
+    for p, col in zip(percentiles, columns[2:-1]):
+        summary[col] = grouped.quantile(p)
+    summary["max_ms"] = grouped.max()
+    return summary.reset_index().round(2)[columns]
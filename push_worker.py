@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+from perf_spans import finish_run, span, start_run
+
+# ===============================
+# 📤 رفع الملف إلى GitHub في الخلفية - بدون Streamlit
+# ===============================
+# push_func(content, commit_message) هي دالة الرفع الفعلية (GitHubRepoClient.push_file في التطبيق)
+class GitHubPushWorker:
+    """عامل خلفي يرفع الملف المحلي إلى GitHub من قائمة انتظار محفوظة على القرص"""
+
+    def __init__(self, push_func, local_file, queue_file, base_delay=2, max_delay=300, perf_history=None):
+        self._push_func = push_func
+        self._perf_history = perf_history
+        self._local_file = local_file
+        self._queue_file = queue_file
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._status = {"state": "idle", "attempts": 0, "last_error": None, "last_success": None}
+        self._thread = threading.Thread(target=self._run, name="github-push-worker", daemon=True)
+        self._thread.start()
+        # عمليات رفع متبقية من تشغيل سابق
+        if self.pending_count():
+            self._wakeup.set()
+
+    def _load_jobs(self):
+        if not os.path.exists(self._queue_file):
+            return []
+        try:
+            with open(self._queue_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return []
+
+    def _save_jobs(self, jobs):
+        tmp_path = f"{self._queue_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self._queue_file)
+
+    def enqueue(self, commit_message):
+        """إضافة عملية رفع للقائمة وإيقاظ العامل"""
+        with self._lock:
+            jobs = self._load_jobs()
+            jobs.append({"id": uuid.uuid4().hex, "message": commit_message, "queued_at": datetime.now().isoformat()})
+            self._save_jobs(jobs)
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._load_jobs())
+
+    def status(self):
+        """نسخة من حالة العامل للعرض في الواجهة"""
+        with self._lock:
+            return dict(self._status, pending=len(self._load_jobs()))
+
+    def _set_status(self, **changes):
+        with self._lock:
+            self._status.update(changes)
+
+    def _run(self):
+        delay = None
+        while True:
+            self._wakeup.wait(timeout=delay)
+            self._wakeup.clear()
+
+            with self._lock:
+                jobs = self._load_jobs()
+            if not jobs:
+                delay = None
+                self._set_status(state="idle")
+                continue
+
+            # كل التعديلات المعلقة ترفع في commit واحد بمحتوى الملف الحالي
+            if len(jobs) == 1:
+                message = jobs[0]["message"]
+            else:
+                message = f"{len(jobs)} updates: " + " | ".join(job["message"] for job in jobs)
+            self._set_status(state="pushing")
+            if self._perf_history is not None:
+                start_run(self._perf_history, "github_push")
+            try:
+                with open(self._local_file, "rb") as f:
+                    content = f.read()
+                with span("github_push"):
+                    self._push_func(content, message)
+            except Exception as e:
+                attempts = self._status["attempts"] + 1
+                delay = min(self._base_delay * 2 ** (attempts - 1), self._max_delay)
+                self._set_status(state="retrying", attempts=attempts, last_error=str(e))
+                continue
+            finally:
+                finish_run()
+
+            pushed_ids = {job["id"] for job in jobs}
+            with self._lock:
+                remaining = [job for job in self._load_jobs() if job["id"] not in pushed_ids]
+                self._save_jobs(remaining)
+            self._set_status(state="idle", attempts=0, last_error=None, last_success=datetime.now().isoformat())
+            delay = None
+            if remaining:
+                self._wakeup.set()
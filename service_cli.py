@@ -0,0 +1,128 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+from service_engine import (
+    VIEW_OPTIONS,
+    build_fleet_report,
+    build_service_status_table,
+    card_number_from_sheet,
+    create_fleet_executor,
+    machine_tonnage_defaults,
+    select_plan_slices,
+)
+from workbook_store import EXPORT_FORMATS, SIDECAR_DIR, export_table_bytes, open_workbook
+
+# ===============================
+# 🧾 فحص الماكينات من سطر الأوامر (بدون Streamlit)
+# ===============================
+# أمثلة:
+#   python service_cli.py Machine_Service_Lookup.xlsx --card 3 --tons 1200
+#   python service_cli.py Machine_Service_Lookup.xlsx --card 1 --card 2 --view below --output report.csv
+#   python service_cli.py Machine_Service_Lookup.xlsx --fleet --workers 4 --output fleet.xlsx
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="فحص حالة خدمات الماكينات من ملف Excel")
+    parser.add_argument("workbook", help="مسار ملف Excel")
+    parser.add_argument("--card", type=int, action="append", default=[], help="رقم الماكينة (يمكن تكراره)")
+    parser.add_argument(
+        "--tons", type=int, action="append", default=[],
+        help="الطن الحالي: قيمة واحدة لكل الماكينات أو قيمة لكل --card (الافتراضي من شيت Machine)"
+    )
+    parser.add_argument("--view", choices=VIEW_OPTIONS, default="current", help="نطاق العرض")
+    parser.add_argument("--min", dest="min_range", type=int, help="بداية النطاق المخصص (طن)")
+    parser.add_argument("--max", dest="max_range", type=int, help="نهاية النطاق المخصص (طن)")
+    parser.add_argument("--fleet", action="store_true", help="تقرير الخدمات المتأخرة لكل الماكينات")
+    parser.add_argument("--workers", type=int, help="عدد العمليات لتقرير الأسطول")
+    parser.add_argument("--output", help="حفظ النتائج في ملف .csv أو .xlsx بدلاً من الطباعة")
+    parser.add_argument("--sidecar-dir", default=SIDECAR_DIR, help="مجلد النسخة السريعة للشيتات")
+    return parser.parse_args(argv)
+
+def resolve_tonnage(cards, tons, sheets):
+    """الطن الحالي لكل ماكينة مطلوبة"""
+    if len(tons) == 1:
+        return {card: tons[0] for card in cards}
+    if tons and len(tons) != len(cards):
+        raise ValueError("عدد قيم --tons يجب أن يكون 1 أو مساوياً لعدد --card")
+    if tons:
+        return dict(zip(cards, tons))
+    defaults = machine_tonnage_defaults(sheets)
+    return {card: defaults.get(card, 0) for card in cards}
+
+def run_status(workbook, args):
+    """جدول حالة الخدمات للماكينات المطلوبة"""
+    sheets = workbook.lazy(workbook.typed)
+    if not args.card:
+        raise ValueError("حدد رقم ماكينة واحد على الأقل عبر --card أو استخدم --fleet")
+    tons_by_card = resolve_tonnage(args.card, args.tons, sheets)
+    plan_df = sheets["ServicePlan"]
+    plan_index = workbook.tonnage_index("ServicePlan")
+
+    tables = []
+    for card_num in args.card:
+        sheet_name = f"Card{card_num}"
+        if sheet_name not in sheets:
+            raise ValueError(f"لا يوجد شيت باسم {sheet_name}")
+        selected_slices = select_plan_slices(
+            plan_df, tons_by_card[card_num], args.view, args.min_range, args.max_range, plan_index
+        )
+        tables.append(build_service_status_table(
+            card_num, sheets[sheet_name], selected_slices,
+            workbook.schema(sheet_name), workbook.tonnage_index(sheet_name)
+        ))
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+def run_fleet(workbook, args):
+    """تقرير الأسطول لكل شيتات الماكينات (أو الماكينات المحددة فقط)"""
+    sheets = workbook.lazy(workbook.typed)
+    card_sheets = sorted(
+        (card_number_from_sheet(name), name) for name in sheets if card_number_from_sheet(name) is not None
+    )
+    if args.card:
+        card_sheets = [(num, name) for num, name in card_sheets if num in args.card]
+    tons_by_card = resolve_tonnage([num for num, _ in card_sheets], args.tons, sheets)
+    jobs = [(num, tons_by_card[num], sheets[name]) for num, name in card_sheets]
+
+    if not args.workers or args.workers < 2:
+        return build_fleet_report(sheets["ServicePlan"], jobs)
+    executor = create_fleet_executor(args.workers)
+    try:
+        return build_fleet_report(sheets["ServicePlan"], jobs, executor, args.workers)
+    finally:
+        executor.shutdown()
+
+def write_output(df, path):
+    """حفظ النتائج حسب امتداد الملف"""
+    fmt = os.path.splitext(path)[1].lower().lstrip(".")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("امتداد ملف الإخراج يجب أن يكون .csv أو .xlsx")
+    with open(path, "wb") as f:
+        f.write(export_table_bytes(df, fmt))
+
+def main(argv=None):
+    args = parse_args(argv)
+    workbook = open_workbook(args.workbook, sidecar_dir=args.sidecar_dir)
+    if workbook is None:
+        print(f"❌ الملف غير موجود: {args.workbook}", file=sys.stderr)
+        return 2
+    if "ServicePlan" not in workbook.sheet_names():
+        print("❌ الملف لا يحتوي على شيت ServicePlan.", file=sys.stderr)
+        return 2
+
+    try:
+        result_df = run_fleet(workbook, args) if args.fleet else run_status(workbook, args)
+        if args.output:
+            write_output(result_df, args.output)
+            print(f"✅ تم حفظ {len(result_df)} سجل في {args.output}")
+        else:
+            with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+                print(result_df.to_string(index=False))
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,570 @@
+import contextlib
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# ===============================
+# ⚡ محرك فحص الخدمات - بدون Streamlit حتى يمكن استخدامه في عمليات منفصلة
+# ===============================
+
+# -------------------------------
+# 🧰 دوال مساعدة للنصوص
+# -------------------------------
+def normalize_name(s):
+    if s is None: return ""
+    s = str(s).replace("\n", "+")
+    s = re.sub(r"[^0-9a-zA-Z\u0600-\u06FF\+\s_/.-]", " ", s)
+    s = re.sub(r"\s+", " ", s).strip().lower()
+    return s
+
+def split_needed_services(needed_service_str):
+    if not isinstance(needed_service_str, str) or needed_service_str.strip() == "":
+        return []
+    parts = re.split(r"\+|,|\n|;", needed_service_str)
+    return [p.strip() for p in parts if p.strip() != ""]
+
+# -------------------------------
+# 🗂 أدوار الأعمدة ومخطط الشيت
+# -------------------------------
+SERVICE_METADATA_COLUMNS = {
+    "card", "Tones", "Min_Tones", "Max_Tones", "Date",
+    "Other", "Servised by", "Event", "Correction",
+    "Card", "TONES", "MIN_TONES", "MAX_TONES", "DATE",
+    "OTHER", "EVENT", "CORRECTION", "SERVISED BY",
+    "servised by", "Servised By",
+    "Serviced by", "Service by", "Serviced By", "Service By",
+    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
+}
+
+EVENT_COLUMN_ALIASES = [
+    "Event", "EVENT", "event", "Events", "events",
+    "الحدث", "الأحداث", "event", "events"
+]
+EVENT_COLUMN_NORMALIZED = ["event", "events", "الحدث", "الأحداث"]
+
+CORRECTION_COLUMN_ALIASES = [
+    "Correction", "CORRECTION", "correction", "Correct", "correct",
+    "تصحيح", "تصويب", "تصحيحات", "correction", "correct"
+]
+CORRECTION_COLUMN_NORMALIZED = ["correction", "correct", "تصحيح", "تصويب"]
+
+SERVISED_BY_COLUMN_ALIASES = [
+    "Servised by", "SERVISED BY", "servised by", "Servised By",
+    "Serviced by", "Service by", "Serviced By", "Service By",
+    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
+]
+SERVISED_BY_COLUMN_NORMALIZED = ["servisedby", "servicedby", "serviceby", "خدمبواسطة"]
+
+# القيم التي لا تعتبر خدمة منجزة
+SERVICE_NOT_DONE_VALUES = {"nan", "none", "", "null", "0", "no", "false", "not done", "لم تتم", "x", "-"}
+
+def get_service_columns(card_df):
+    """أعمدة الخدمات في شيت الكارت (كل الأعمدة ما عدا أعمدة البيانات الوصفية)"""
+    metadata_normalized = {normalize_name(mc) for mc in SERVICE_METADATA_COLUMNS}
+    return [
+        col for col in card_df.columns
+        if col not in SERVICE_METADATA_COLUMNS and normalize_name(col) not in metadata_normalized
+    ]
+
+def get_role_columns(card_df, aliases, normalized_aliases):
+    """ترتيب الأعمدة المرشحة لدور معين (Event / Correction / Servised by)"""
+    columns = [c for c in dict.fromkeys(aliases) if c in card_df.columns]
+    columns += [c for c in card_df.columns if normalize_name(c) in normalized_aliases and c not in columns]
+    return columns
+
+# أسماء أعمدة الرينج والكارت المستخدمة عند إضافة صف جديد
+MIN_TONES_COLUMN_NAMES = ("min_tones", "min_tone", "min tones", "min")
+MAX_TONES_COLUMN_NAMES = ("max_tones", "max_tone", "max tones", "max")
+CARD_COLUMN_NAMES = ("card", "machine", "machine_no", "machine id")
+
+def resolve_sheet_schema(df):
+    """تحديد أدوار أعمدة الشيت مرة واحدة (الخدمات / Event / Correction / Servised by / الرينج)"""
+    service_columns = get_service_columns(df)
+    schema = {
+        "service_columns": service_columns,
+        "service_norm": [normalize_name(c) for c in service_columns],
+        "event": get_role_columns(df, EVENT_COLUMN_ALIASES, EVENT_COLUMN_NORMALIZED),
+        "correction": get_role_columns(df, CORRECTION_COLUMN_ALIASES, CORRECTION_COLUMN_NORMALIZED),
+        "servised_by": get_role_columns(df, SERVISED_BY_COLUMN_ALIASES, SERVISED_BY_COLUMN_NORMALIZED),
+        "min_tones": None,
+        "max_tones": None,
+        "card": None,
+    }
+    for c in df.columns:
+        c_low = str(c).strip().lower()
+        if c_low in MIN_TONES_COLUMN_NAMES:
+            schema["min_tones"] = c
+        if c_low in MAX_TONES_COLUMN_NAMES:
+            schema["max_tones"] = c
+        if c_low in CARD_COLUMN_NAMES:
+            schema["card"] = c
+    return schema
+
+def _stripped_text(values):
+    return values.map(lambda v: str(v).strip(), na_action="ignore")
+
+def _first_filled_text(card_df, columns):
+    """أول قيمة غير فارغة لكل صف من بين الأعمدة المرشحة بالترتيب"""
+    result = pd.Series("-", index=card_df.index, dtype=object)
+    for col in reversed(columns):
+        text = _stripped_text(card_df[col])
+        result = result.where(~(text.notna() & text.ne("")), text)
+    return result
+
+def _cell_text(card_df, col):
+    if col not in card_df.columns:
+        return pd.Series("-", index=card_df.index, dtype=object)
+    return _stripped_text(card_df[col]).astype(object).fillna("-")
+
+def _tonnage_values(df, col):
+    if col not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+# -------------------------------
+# 📏 فهرس نطاقات الأطنان
+# -------------------------------
+class TonnageIndex:
+    """فهرس مرتب لنطاقات الأطنان (Min_Tones / Max_Tones) - الاستعلامات بالبحث الثنائي بدل المرور على كل الصفوف"""
+
+    def __init__(self, mins, maxs):
+        self.mins = np.asarray(mins, dtype=float)
+        self.maxs = np.asarray(maxs, dtype=float)
+        # القيم الفارغة لا تطابق أي شرط (مثل المقارنة العادية مع NaN)
+        self._by_min = np.argsort(np.where(np.isnan(self.mins), np.inf, self.mins), kind="stable")
+        self._by_min = self._by_min[~np.isnan(self.mins[self._by_min])]
+        self._sorted_min = self.mins[self._by_min]
+        self._by_max = np.argsort(np.where(np.isnan(self.maxs), np.inf, self.maxs), kind="stable")
+        self._by_max = self._by_max[~np.isnan(self.maxs[self._by_max])]
+        self._sorted_max = self.maxs[self._by_max]
+        # أكبر Max حتى كل موضع في ترتيب Min - يحدد بداية النطاقات المتقاطعة
+        self._max_prefix = np.maximum.accumulate(np.nan_to_num(self.maxs[self._by_min], nan=-np.inf)) if len(self._by_min) else self._sorted_min
+
+    @classmethod
+    def from_frame(cls, df, fill_value=None):
+        mins = _tonnage_values(df, "Min_Tones")
+        maxs = _tonnage_values(df, "Max_Tones")
+        if fill_value is not None:
+            mins = np.nan_to_num(mins, nan=fill_value)
+            maxs = np.nan_to_num(maxs, nan=fill_value)
+        return cls(mins, maxs)
+
+    def __len__(self):
+        return len(self.mins)
+
+    def overlapping(self, low, high):
+        """الصفوف التي يتقاطع نطاقها مع [low, high] (Min <= high و Max >= low)"""
+        _, positions = self.overlapping_many([low], [high])
+        return positions
+
+    def overlapping_many(self, lows, highs):
+        """أزواج (رقم الاستعلام، رقم الصف) لكل النطاقات المتقاطعة - مرتبة حسب الاستعلام ثم الصف"""
+        lows = np.asarray(lows, dtype=float)
+        highs = np.asarray(highs, dtype=float)
+        ends = np.searchsorted(self._sorted_min, highs, side="right")
+        starts = np.minimum(np.searchsorted(self._max_prefix, lows, side="left"), ends)
+        # استعلامات بحدود فارغة لا تطابق شيئاً
+        ends = np.where(np.isnan(lows) | np.isnan(highs), starts, ends)
+        lengths = ends - starts
+        query_ids = np.repeat(np.arange(len(lows)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+        positions = self._by_min[offsets]
+        keep = self.maxs[positions] >= lows[query_ids]
+        query_ids, positions = query_ids[keep], positions[keep]
+        order = np.lexsort((positions, query_ids))
+        return query_ids[order], positions[order]
+
+    def containing(self, value):
+        """الصفوف التي تحتوي القيمة (Min <= value <= Max)"""
+        return self.overlapping(value, value)
+
+    def max_at_most(self, value):
+        """الصفوف التي Max فيها <= value"""
+        return np.sort(self._by_max[:np.searchsorted(self._sorted_max, value, side="right")])
+
+    def min_at_most(self, value):
+        """الصفوف التي Min فيها <= value"""
+        return np.sort(self._by_min[:np.searchsorted(self._sorted_min, value, side="right")])
+
+    def min_at_least(self, value):
+        """الصفوف التي Min فيها >= value"""
+        return np.sort(self._by_min[np.searchsorted(self._sorted_min, value, side="left"):])
+
+    def within(self, low, high):
+        """الصفوف التي يقع نطاقها بالكامل داخل [low, high]"""
+        candidates = self.min_at_least(low)
+        return candidates[self.maxs[candidates] <= high]
+
+# نطاقات العرض: current / below / above / range / all
+VIEW_OPTIONS = ("current", "below", "above", "range", "all")
+
+def select_plan_slices(plan_df, current_tons, view="current", min_range=None, max_range=None, plan_index=None):
+    """اختيار شرائح ServicePlan حسب نطاق العرض عبر الفهرس المرتب"""
+    if view not in VIEW_OPTIONS:
+        raise ValueError(f"Unknown view option: {view}")
+    if view == "all":
+        return plan_df.copy()
+    if plan_index is None:
+        plan_index = TonnageIndex.from_frame(plan_df)
+    if view == "current":
+        return plan_df.iloc[plan_index.containing(current_tons)]
+    if view == "below":
+        return plan_df.iloc[plan_index.max_at_most(current_tons)]
+    if view == "above":
+        return plan_df.iloc[plan_index.min_at_least(current_tons)]
+    low = max(0, current_tons - 500) if min_range is None else min_range
+    high = current_tons + 500 if max_range is None else max_range
+    return plan_df.iloc[plan_index.within(low, high)]
+
+# -------------------------------
+# ➕ موضع إضافة الصفوف في شيت Card (بحث ثنائي على مفاتيح الأطنان المرتبة)
+# -------------------------------
+def _row_keys(df, schema):
+    """مفاتيح Min / Max الرقمية ورقم الماكينة كنص لكل صف"""
+    min_col, max_col, card_col = schema["min_tones"], schema["max_tones"], schema["card"]
+    mins = pd.to_numeric(df[min_col], errors="coerce").to_numpy(dtype=float)
+    maxs = pd.to_numeric(df[max_col], errors="coerce").to_numpy(dtype=float)
+    cards = _stripped_text(df[card_col]).to_numpy(dtype=object) if card_col else None
+    return mins, maxs, cards
+
+class RowInsertIndex:
+    """مفاتيح الأطنان المرتبة لشيت واحد - الصف الجديد يضاف بعد آخر صف بنفس الرينج (ونفس الماكينة)
+    وإلا قبل أول صف Min فيه >= Min الجديد (الصفوف بدون Min تعتبر -1)"""
+
+    def __init__(self, mins, maxs, cards=None):
+        self.mins = np.asarray(mins, dtype=float)
+        self.maxs = np.asarray(maxs, dtype=float)
+        self.cards = None if cards is None else np.asarray(cards, dtype=object)
+        self._sorted_min = np.sort(np.nan_to_num(self.mins, nan=-1))
+        # أزواج (Min, Max) مرتبة ثم رقم الصف - للبحث عن نفس الرينج
+        valid = np.flatnonzero(~np.isnan(self.mins) & ~np.isnan(self.maxs))
+        self._by_range = valid[np.lexsort((valid, self.maxs[valid], self.mins[valid]))]
+        self._range_min = self.mins[self._by_range]
+        self._range_max = self.maxs[self._by_range]
+
+    @classmethod
+    def from_frame(cls, df, schema):
+        """None إذا لم يكن في الشيت عمودا Min_Tones و Max_Tones"""
+        if not schema["min_tones"] or not schema["max_tones"]:
+            return None
+        return cls(*_row_keys(df, schema))
+
+    def __len__(self):
+        return len(self.mins)
+
+    def _last_same_range(self, min_value, max_value, card):
+        lo = np.searchsorted(self._range_min, min_value, side="left")
+        hi = np.searchsorted(self._range_min, min_value, side="right")
+        lo, hi = lo + np.searchsorted(self._range_max[lo:hi], max_value, side="left"), \
+            lo + np.searchsorted(self._range_max[lo:hi], max_value, side="right")
+        candidates = self._by_range[lo:hi]
+        if self.cards is not None:
+            # في شيت فيه عمود card لا تتم المطابقة بدون رقم الماكينة
+            if not card:
+                return None
+            candidates = candidates[self.cards[candidates] == card]
+        return int(candidates[-1]) if len(candidates) else None
+
+    def insert_positions(self, mins, maxs, cards=None):
+        """موضع كل صف جديد بالنسبة للشيت الحالي (قبل إضافة أي منها)"""
+        mins = np.asarray(mins, dtype=float)
+        maxs = np.asarray(maxs, dtype=float)
+        positions = np.where(
+            np.isnan(mins), len(self), np.searchsorted(self._sorted_min, np.nan_to_num(mins), side="left")
+        )
+        for i in np.flatnonzero(~np.isnan(mins) & ~np.isnan(maxs)):
+            last = self._last_same_range(mins[i], maxs[i], None if cards is None else cards[i])
+            if last is not None:
+                positions[i] = last + 1
+        return positions
+
+    def insert_position(self, min_value, max_value, card=None):
+        return int(self.insert_positions([min_value], [max_value], [card])[0])
+
+def merge_sorted_rows(df, new_rows, schema, index=None):
+    """إضافة كل الصفوف الجديدة في مواضعها دفعة واحدة - يرجع (الشيت الجديد، الفهرس المحدث)
+
+    الصفوف التي تقع في نفس الموضع ترتب حسب Min ثم ترتيب إدخالها."""
+    if index is None or len(index) != len(df):
+        index = RowInsertIndex.from_frame(df, schema)
+    if index is None:
+        raise ValueError("Sheet has no Min_Tones / Max_Tones columns")
+    new_rows = new_rows.reindex(columns=df.columns).astype(object).reset_index(drop=True)
+    new_mins, new_maxs, new_cards = _row_keys(new_rows, schema)
+    positions = index.insert_positions(new_mins, new_maxs, new_cards)
+
+    # ترتيب واحد للصفوف القديمة والجديدة: الصف الجديد في الموضع p يأتي قبل الصف القديم رقم p
+    n_old, n_new = len(df), len(new_rows)
+    major = np.concatenate([np.arange(n_old), positions])
+    minor = np.concatenate([np.ones(n_old), np.zeros(n_new)])
+    min_key = np.concatenate([np.zeros(n_old), np.nan_to_num(new_mins, nan=np.inf)])
+    order = np.lexsort((np.arange(n_old + n_new), min_key, minor, major))
+
+    merged = pd.concat([df.reset_index(drop=True).astype(object), new_rows], ignore_index=True)
+    merged = merged.take(order).reset_index(drop=True)
+    merged_cards = None if index.cards is None else np.concatenate([index.cards, new_cards])[order]
+    updated = RowInsertIndex(
+        np.concatenate([index.mins, new_mins])[order],
+        np.concatenate([index.maxs, new_maxs])[order],
+        merged_cards,
+    )
+    return merged, updated
+
+def _match_sheet_columns(import_columns, sheet_columns):
+    """ربط أعمدة ملف الاستيراد بأعمدة الشيت (نفس الاسم أو بعد توحيد الكتابة) - يرجع (الربط، الأعمدة غير المعروفة)"""
+    by_norm = {normalize_name(c): c for c in sheet_columns}
+    mapping, unknown = {}, []
+    for col in import_columns:
+        target = col if col in sheet_columns else by_norm.get(normalize_name(col))
+        if target is None or target in mapping.values():
+            unknown.append(str(col))
+        else:
+            mapping[col] = target
+    return mapping, unknown
+
+def plan_bulk_import(import_df, sheets, schemas):
+    """توزيع صفوف ملف الاستيراد على شيتات Card مع التحقق من أعمدة كل شيت
+
+    يرجع ({اسم الشيت: الصفوف بأعمدة الشيت}, [الأخطاء]) - أي خطأ يلغي الاستيراد كله.
+    أرقام الصفوف في الأخطاء هي أرقامها في الملف (الصف 1 عناوين)."""
+    if import_df.empty:
+        return {}, ["الملف لا يحتوي على صفوف"]
+    card_col = next((c for c in import_df.columns if str(c).strip().lower() in CARD_COLUMN_NAMES), None)
+    if card_col is None:
+        return {}, ["الملف لا يحتوي على عمود card (رقم الماكينة)"]
+
+    errors = []
+    card_numbers = pd.to_numeric(import_df[card_col], errors="coerce")
+    valid = card_numbers.notna() & (card_numbers % 1 == 0)
+    for i in import_df.index[~valid]:
+        errors.append(f"الصف {i + 2}: رقم الماكينة غير صالح ({import_df.at[i, card_col]})")
+
+    rows_by_sheet = {}
+    for card_num, rows in import_df[valid].groupby(card_numbers[valid].astype(int), sort=True):
+        sheet_name = f"Card{card_num}"
+        if sheet_name not in sheets:
+            errors.append(f"لا يوجد شيت باسم {sheet_name} ({len(rows)} صف)")
+            continue
+        sheet_df, schema = sheets[sheet_name], schemas[sheet_name]
+        min_col, max_col = schema["min_tones"], schema["max_tones"]
+        if not min_col or not max_col:
+            errors.append(f"{sheet_name}: لا يحتوي على أعمدة Min_Tones و Max_Tones")
+            continue
+
+        mapping, unknown = _match_sheet_columns([c for c in rows.columns if c != card_col], list(sheet_df.columns))
+        if unknown:
+            errors.append(f"{sheet_name}: أعمدة غير موجودة في الشيت أو مكررة: {', '.join(unknown)}")
+            continue
+        rows = rows.drop(columns=[card_col]).rename(columns=mapping)
+
+        missing = [col for col in (min_col, max_col) if col not in rows.columns]
+        if missing:
+            errors.append(f"{sheet_name}: الملف لا يحتوي على {' و '.join(missing)}")
+            continue
+        for col in (min_col, max_col):
+            bad = rows.index[pd.to_numeric(rows[col], errors="coerce").isna()]
+            errors += [f"الصف {i + 2}: قيمة {col} غير رقمية ({rows.at[i, col]})" for i in bad]
+
+        if schema["card"]:
+            rows[schema["card"]] = str(card_num)
+        rows_by_sheet[sheet_name] = rows.reindex(columns=sheet_df.columns).astype(object)
+
+    return ({} if errors else rows_by_sheet), errors
+
+# -------------------------------
+# 📋 جدول حالة الخدمات لماكينة واحدة
+# -------------------------------
+RESULT_COLUMNS = [
+    "Card Number", "Min_Tons", "Max_Tons", "Service Needed", "Service Done",
+    "Service Didn't Done", "Tones", "Event", "Correction", "Servised by", "Date"
+]
+
+def service_done_matrix(card_df, service_columns):
+    """مصفوفة منطقية (الأحداث × أعمدة الخدمات) توضح الخدمات المنجزة"""
+    done = {}
+    for col in service_columns:
+        values = card_df[col]
+        text = _stripped_text(values).astype(object).str.lower()
+        done[col] = values.notna() & ~text.isin(SERVICE_NOT_DONE_VALUES)
+    return pd.DataFrame(done, index=card_df.index, columns=service_columns, dtype=bool)
+
+def _join_true_labels(matrix, labels):
+    """تجميع أسماء الأعمدة الصحيحة لكل صف في نص واحد مفصول بفاصلة"""
+    if not labels:
+        return np.full(len(matrix), "-", dtype=object)
+    suffixed = np.array([f"{label}, " for label in labels], dtype=object)
+    joined = matrix.astype(object).dot(suffixed)
+    return np.array([s[:-2] if s else "-" for s in joined], dtype=object)
+
+def build_service_status_table(card_num, card_df, selected_slices, schema=None, event_index=None):
+    """بناء جدول نتائج الفحص لكل الشرائح المختارة دفعة واحدة"""
+    if schema is None:
+        schema = resolve_sheet_schema(card_df)
+    if event_index is None:
+        event_index = TonnageIndex.from_frame(card_df, fill_value=0)
+    if selected_slices.empty:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # الخدمات المطلوبة لكل شريحة
+    service_values = selected_slices["Service"] if "Service" in selected_slices.columns else pd.Series("", index=selected_slices.index)
+    needed_parts = [split_needed_services(v) for v in service_values]
+    needed_text = [" + ".join(parts) if parts else "-" for parts in needed_parts]
+
+    # تقاطع نطاقات الشرائح مع نطاقات الأحداث عبر الفهرس المرتب
+    slice_min_raw = selected_slices["Min_Tones"].to_numpy()
+    slice_max_raw = selected_slices["Max_Tones"].to_numpy()
+    pair_slice, pair_event = event_index.overlapping_many(
+        _tonnage_values(selected_slices, "Min_Tones"),
+        _tonnage_values(selected_slices, "Max_Tones"),
+    )
+
+    # الخدمات المنجزة لكل حدث
+    service_columns = schema["service_columns"]
+    done = service_done_matrix(card_df, service_columns)
+    done_sorted_labels = sorted(service_columns)
+    done_text = _join_true_labels(done[done_sorted_labels].to_numpy(), done_sorted_labels)
+
+    # الخدمات المنجزة مجمعة حسب الاسم الموحد للمقارنة مع المطلوب
+    done_by_norm = done.T.groupby(schema["service_norm"]).any().T
+    norm_position = {norm: i for i, norm in enumerate(done_by_norm.columns)}
+    done_lookup = np.hstack([done_by_norm.to_numpy(dtype=bool), np.zeros((len(card_df), 1), dtype=bool)])
+
+    # الخدمات غير المنجزة لكل زوج (شريحة، حدث)
+    needs = [
+        (slice_pos, part_pos, part, norm_position.get(normalize_name(part), len(norm_position)))
+        for slice_pos, parts in enumerate(needed_parts)
+        for part_pos, part in enumerate(parts)
+    ]
+    needs_df = pd.DataFrame(needs, columns=["slice", "part_pos", "part", "done_col"])
+    pairs_df = pd.DataFrame({"pair": np.arange(len(pair_slice)), "slice": pair_slice, "event": pair_event})
+    pair_needs = pairs_df.merge(needs_df, on="slice").sort_values(["pair", "part_pos"], kind="stable")
+    missing = pair_needs[~done_lookup[pair_needs["event"].to_numpy(), pair_needs["done_col"].to_numpy()]]
+    not_done_text = missing.groupby("pair", sort=True)["part"].agg(", ".join)
+    pair_not_done = not_done_text.reindex(pairs_df["pair"]).fillna("-").to_numpy(dtype=object)
+
+    tones_text = _cell_text(card_df, "Tones").to_numpy()
+    date_text = _cell_text(card_df, "Date").to_numpy()
+    event_text = _first_filled_text(card_df, schema["event"]).to_numpy()
+    correction_text = _first_filled_text(card_df, schema["correction"]).to_numpy()
+    servised_by_text = _first_filled_text(card_df, schema["servised_by"]).to_numpy()
+
+    matched = pd.DataFrame({
+        "Card Number": card_num,
+        "Min_Tons": slice_min_raw[pair_slice],
+        "Max_Tons": slice_max_raw[pair_slice],
+        "Service Needed": np.array(needed_text, dtype=object)[pair_slice],
+        "Service Done": done_text[pair_event],
+        "Service Didn't Done": pair_not_done,
+        "Tones": tones_text[pair_event],
+        "Event": event_text[pair_event],
+        "Correction": correction_text[pair_event],
+        "Servised by": servised_by_text[pair_event],
+        "Date": date_text[pair_event],
+        "_slice": pair_slice,
+        "_event": pair_event,
+    })
+
+    # الشرائح التي لا توجد لها أحداث
+    empty_slices = np.setdiff1d(np.arange(len(selected_slices)), pair_slice)
+    unmatched = pd.DataFrame({
+        "Card Number": card_num,
+        "Min_Tons": slice_min_raw[empty_slices],
+        "Max_Tons": slice_max_raw[empty_slices],
+        "Service Needed": np.array(needed_text, dtype=object)[empty_slices],
+        "Service Done": "-",
+        "Service Didn't Done": np.array([", ".join(needed_parts[i]) if needed_parts[i] else "-" for i in empty_slices], dtype=object),
+        "Tones": "-",
+        "Event": "-",
+        "Correction": "-",
+        "Servised by": "-",
+        "Date": "-",
+        "_slice": empty_slices,
+        "_event": -1,
+    })
+
+    frames = [f for f in (matched, unmatched) if not f.empty]
+    result_df = pd.concat(frames, ignore_index=True).sort_values(["_slice", "_event"], kind="stable")
+    return result_df.drop(columns=["_slice", "_event"]).dropna(how="all").reset_index(drop=True)
+
+# -------------------------------
+# 🏭 تقرير الأسطول - كل الماكينات دفعة واحدة
+# -------------------------------
+def card_number_from_sheet(sheet_name):
+    """رقم الماكينة من اسم الشيت (Card12 -> 12) أو None"""
+    match = re.fullmatch(r"Card(\d+)", str(sheet_name).strip())
+    return int(match.group(1)) if match else None
+
+def machine_tonnage_defaults(sheets):
+    """الطن الحالي لكل ماكينة من شيت Machine إن وجد"""
+    if "Machine" not in sheets:
+        return {}
+    machine_df = sheets["Machine"]
+    if "card" not in machine_df.columns or "Current_Tones" not in machine_df.columns:
+        return {}
+    tons = pd.to_numeric(machine_df["Current_Tones"], errors="coerce").fillna(0)
+    cards = pd.to_numeric(machine_df["card"], errors="coerce")
+    return {int(c): int(t) for c, t in zip(cards, tons) if pd.notna(c)}
+
+def machine_overdue_services(card_num, current_tons, card_df, plan_df, plan_index=None, schema=None, event_index=None):
+    """الخدمات المتأخرة لماكينة واحدة: كل الشرائح حتى الطن الحالي التي بها خدمات لم تتم"""
+    if plan_index is None:
+        plan_index = TonnageIndex.from_frame(plan_df)
+    reached_slices = plan_df.iloc[plan_index.min_at_most(current_tons)]
+    table = build_service_status_table(card_num, card_df, reached_slices, schema, event_index)
+    overdue = table[table["Service Didn't Done"] != "-"].reset_index(drop=True)
+    overdue.insert(1, "Current Tons", current_tons)
+    return overdue
+
+def _fleet_chunk(plan_df, jobs):
+    plan_index = TonnageIndex.from_frame(plan_df)
+    return [
+        machine_overdue_services(card_num, current_tons, card_df, plan_df, plan_index)
+        for card_num, current_tons, card_df in jobs
+    ]
+
+def build_fleet_report(plan_df, jobs, executor=None, workers=None):
+    """تقرير الأسطول - jobs قائمة (رقم الماكينة، الطن الحالي، شيت الكارت)؛ يوزع العمل على executor إن وجد"""
+    jobs = sorted(jobs, key=lambda job: job[0])
+    if executor is None or len(jobs) < 2:
+        frames = _fleet_chunk(plan_df, jobs)
+    else:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        with _detached_main_module():
+            futures = [executor.submit(_fleet_chunk, plan_df, jobs[i::workers]) for i in range(workers)]
+        frames = [frame for future in futures for frame in future.result()]
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=["Card Number", "Current Tons"] + RESULT_COLUMNS[1:])
+    report = pd.concat(frames, ignore_index=True)
+    return report.sort_values("Card Number", kind="stable").reset_index(drop=True)
+
+_MAIN_MODULE_LOCK = threading.Lock()
+
+# قيود: sys.modules["__main__"] مشترك في العملية كلها - الخيوط الأخرى ترى وحدة فارغة أثناء
+# إرسال المهام، و Streamlit يعيد تعيينه عند بدء تشغيل السكربت في جلسة أخرى. لذلك لا يستعاد
+# الأصل إلا إذا بقيت الوحدة المؤقتة نفسها (حتى لا يكتب فوق وحدة أحدث)؛ وعملية بدأت بسكربت
+# Streamlit بسبب هذا التداخل تفشل وتصل للمستدعي كـ BrokenProcessPool (التطبيق يعيد الفحص بدون توازي).
+@contextlib.contextmanager
+def _detached_main_module():
+    """إخفاء سكربت Streamlit (__main__) أثناء بدء العمليات حتى لا تعيد spawn تشغيله داخلها"""
+    with _MAIN_MODULE_LOCK:
+        main_module = sys.modules.get("__main__")
+        placeholder = types.ModuleType("__main__")
+        sys.modules["__main__"] = placeholder
+        try:
+            yield
+        finally:
+            if sys.modules.get("__main__") is placeholder:
+                sys.modules["__main__"] = main_module
+
+def create_fleet_executor(workers=None):
+    """مجموعة عمليات لتقرير الأسطول (spawn حتى لا تنسخ خيوط الخادم)"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,123 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+# ===============================
+# 🔐 جلسات المستخدمين في SQLite (WAL) - آمنة مع التشغيل المتزامن
+# ===============================
+LOGIN_OK = "ok"
+LOGIN_ALREADY_ACTIVE = "already_active"
+LOGIN_LIMIT_REACHED = "limit"
+
+class SessionStore:
+    """الجلسات النشطة: صف لكل مستخدم بوقت انتهاء مفهرس"""
+
+    def __init__(self, db_path, session_duration, max_active_users):
+        self._db_path = db_path
+        self._duration = session_duration.total_seconds()
+        self._max_active = max_active_users
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " username TEXT PRIMARY KEY,"
+                " login_time REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+
+    def _connection(self):
+        """اتصال واحد لكل خيط (sqlite لا يشارك الاتصال بين الخيوط)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def try_login(self, username, exempt=False):
+        """فحص الحد الأقصى وتسجيل الجلسة في معاملة واحدة (BEGIN IMMEDIATE)"""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+            if not exempt:
+                if conn.execute("SELECT 1 FROM sessions WHERE username = ?", (username,)).fetchone():
+                    return LOGIN_ALREADY_ACTIVE
+                (active_count,) = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+                if active_count >= self._max_active:
+                    return LOGIN_LIMIT_REACHED
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (username, login_time, expires_at) VALUES (?, ?, ?)",
+                (username, now, now + self._duration),
+            )
+        return LOGIN_OK
+
+    def logout(self, username):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE username = ?", (username,))
+
+    def remaining(self, username):
+        """الوقت المتبقي لجلسة المستخدم (أو None إذا انتهت) - استعلام واحد"""
+        if not username:
+            return None
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT expires_at FROM sessions WHERE username = ? AND expires_at > ?", (username, now)
+            ).fetchone()
+        return timedelta(seconds=row[0] - now) if row else None
+
+    def active_users(self):
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT username FROM sessions WHERE expires_at > ? ORDER BY login_time", (time.time(),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def migrate_from_json(self, state_file):
+        """نقل الجلسات النشطة من state.json القديم مرة واحدة ثم إعادة تسمية الملف"""
+        if not os.path.exists(state_file):
+            return 0
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception:
+            state = {}
+
+        rows = []
+        for username, info in state.items():
+            if not isinstance(info, dict) or not info.get("active") or "login_time" not in info:
+                continue
+            try:
+                login_time = datetime.fromisoformat(info["login_time"]).timestamp()
+            except Exception:
+                continue
+            if login_time + self._duration > time.time():
+                rows.append((username, login_time, login_time + self._duration))
+
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO sessions (username, login_time, expires_at) VALUES (?, ?, ?)", rows
+            )
+        os.replace(state_file, f"{state_file}.migrated")
+        return len(rows)
+
+class _Transaction:
+    """تنفيذ COMMIT عند النجاح و ROLLBACK عند الخطأ إذا بدأت معاملة"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __enter__(self):
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
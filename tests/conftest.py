@@ -0,0 +1,5 @@
+import os
+import sys
+
+# الاختبارات تستورد وحدات المشروع من المجلد الرئيسي
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,24 @@
+import sys
+import types
+
+from service_engine import _detached_main_module
+
+
+def test_main_module_is_hidden_and_restored():
+    main_module = sys.modules["__main__"]
+    with _detached_main_module():
+        assert sys.modules["__main__"] is not main_module
+        assert not hasattr(sys.modules["__main__"], "__file__")
+    assert sys.modules["__main__"] is main_module
+
+
+def test_newer_main_module_is_not_overwritten():
+    main_module = sys.modules["__main__"]
+    rerun_module = types.ModuleType("__main__")
+    try:
+        with _detached_main_module():
+            # تشغيل سكربت في جلسة أخرى يعيد تعيين __main__ أثناء إرسال المهام
+            sys.modules["__main__"] = rerun_module
+        assert sys.modules["__main__"] is rerun_module
+    finally:
+        sys.modules["__main__"] = main_module
@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+
+import pytest
+
+from push_worker import GitHubPushWorker
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class FakePush:
+    """دالة رفع وهمية تسجل المحاولات ويمكن أن تفشل أو تنتظر"""
+
+    def __init__(self, failures=0, gate=None):
+        self.failures = failures
+        self.gate = gate
+        self.calls = []
+        self.started = threading.Event()
+
+    def __call__(self, content, message):
+        self.calls.append((time.monotonic(), content, message))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("network down")
+
+
+@pytest.fixture
+def files(tmp_path):
+    local_file = tmp_path / "book.xlsx"
+    local_file.write_bytes(b"v1")
+    return local_file, tmp_path / "push_queue.json"
+
+
+def test_failed_push_is_retried_with_exponential_backoff(files):
+    local_file, queue_file = files
+    push = FakePush(failures=2)
+    worker = GitHubPushWorker(push, str(local_file), str(queue_file), base_delay=0.05, max_delay=1)
+
+    worker.enqueue("edit Card1")
+
+    assert wait_for(lambda: worker.pending_count() == 0)
+    assert len(push.calls) == 3
+    gaps = [b[0] - a[0] for a, b in zip(push.calls, push.calls[1:])]
+    assert gaps[0] >= 0.05 and gaps[1] >= 0.1
+    status = worker.status()
+    assert status["attempts"] == 0 and status["last_error"] is None and status["last_success"]
+
+
+def test_retry_status_reports_the_error(files):
+    local_file, queue_file = files
+    worker = GitHubPushWorker(FakePush(failures=100), str(local_file), str(queue_file), base_delay=60)
+
+    worker.enqueue("edit Card1")
+
+    assert wait_for(lambda: worker.status()["state"] == "retrying")
+    status = worker.status()
+    assert status["attempts"] == 1 and status["last_error"] == "network down" and status["pending"] == 1
+
+
+def test_persisted_queue_is_pushed_on_restart_in_one_commit(files):
+    local_file, queue_file = files
+    # قائمة متبقية من تشغيل سابق توقف قبل الرفع
+    jobs = [{"id": str(i), "message": f"edit {i}", "queued_at": "2024-01-01T00:00:00"} for i in range(3)]
+    queue_file.write_text(json.dumps(jobs), encoding="utf-8")
+    push = FakePush()
+
+    worker = GitHubPushWorker(push, str(local_file), str(queue_file), base_delay=0.01)
+
+    assert wait_for(lambda: worker.pending_count() == 0)
+    assert [(content, message) for _, content, message in push.calls] == [
+        (b"v1", "3 updates: edit 0 | edit 1 | edit 2")
+    ]
+    assert json.loads(queue_file.read_text(encoding="utf-8")) == []
+
+
+def test_jobs_enqueued_during_a_push_are_kept_and_pushed_next(files):
+    local_file, queue_file = files
+    gate = threading.Event()
+    push = FakePush(gate=gate)
+    worker = GitHubPushWorker(push, str(local_file), str(queue_file), base_delay=0.01)
+
+    worker.enqueue("edit 1")
+    assert push.started.wait(5)
+    # حفظان جديدان أثناء الرفع الأول - لا يحذفان عند انتهائه
+    local_file.write_bytes(b"v2")
+    worker.enqueue("edit 2")
+    worker.enqueue("edit 3")
+    gate.set()
+
+    assert wait_for(lambda: worker.pending_count() == 0 and len(push.calls) == 2)
+    assert [(content, message) for _, content, message in push.calls] == [
+        (b"v1", "edit 1"),
+        (b"v2", "2 updates: edit 2 | edit 3"),
+    ]
@@ -0,0 +1,72 @@
+import threading
+import time
+from datetime import timedelta
+
+from session_store import LOGIN_ALREADY_ACTIVE, LOGIN_LIMIT_REACHED, LOGIN_OK, SessionStore
+
+
+def _store(tmp_path, minutes=15, max_active=2):
+    return SessionStore(str(tmp_path / "sessions.db"), timedelta(minutes=minutes), max_active)
+
+
+def test_concurrent_logins_never_exceed_the_limit(tmp_path):
+    store = _store(tmp_path)
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def login(username):
+        barrier.wait()
+        results[username] = store.try_login(username)
+
+    threads = [threading.Thread(target=login, args=(f"user{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = sorted(user for user, result in results.items() if result == LOGIN_OK)
+    assert len(winners) == 2
+    assert list(results.values()).count(LOGIN_LIMIT_REACHED) == 6
+    assert sorted(store.active_users()) == winners
+
+
+def test_concurrent_logins_from_separate_stores_share_the_limit(tmp_path):
+    # كل عملية خادم تفتح مخزنها الخاص على نفس قاعدة البيانات
+    stores = [_store(tmp_path) for _ in range(6)]
+    barrier = threading.Barrier(len(stores))
+    results = []
+
+    def login(store, username):
+        barrier.wait()
+        results.append(store.try_login(username))
+
+    threads = [threading.Thread(target=login, args=(store, f"user{i}")) for i, store in enumerate(stores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(LOGIN_OK) == 2
+    assert len(stores[0].active_users()) == 2
+
+
+def test_same_user_cannot_log_in_twice(tmp_path):
+    store = _store(tmp_path)
+    assert store.try_login("ali") == LOGIN_OK
+    assert store.try_login("ali") == LOGIN_ALREADY_ACTIVE
+
+
+def test_exempt_user_bypasses_the_limit(tmp_path):
+    store = _store(tmp_path, max_active=1)
+    assert store.try_login("ali") == LOGIN_OK
+    assert store.try_login("admin", exempt=True) == LOGIN_OK
+    assert store.try_login("sara") == LOGIN_LIMIT_REACHED
+
+
+def test_expired_sessions_free_their_slot(tmp_path):
+    store = _store(tmp_path, minutes=0.001, max_active=1)
+    assert store.try_login("ali") == LOGIN_OK
+    time.sleep(0.1)
+    assert store.remaining("ali") is None
+    assert store.try_login("sara") == LOGIN_OK
+    assert store.active_users() == ["sara"]
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import user_store
+from user_store import UserStore, hash_password, is_password_hashed, migrate_user_record, verify_password
+
+
+def _write_users(path, users):
+    path.write_text(json.dumps(users), encoding="utf-8")
+
+
+def test_legacy_plaintext_record_is_migrated_and_still_verifies():
+    record = {"password": "secret1"}
+
+    assert migrate_user_record("ali", record) is True
+
+    assert is_password_hashed(record["password"]) and "secret1" not in record["password"]
+    assert verify_password(record["password"], "secret1")
+    assert record["role"] == "viewer" and record["permissions"] == ["view"]
+    # السجل المرحل لا يتغير مرة أخرى
+    assert migrate_user_record("ali", record) is False
+
+
+def test_wrong_password_is_rejected():
+    stored = hash_password("secret1", iterations=1000)
+
+    assert verify_password(stored, "secret1")
+    assert not verify_password(stored, "secret2")
+    assert not verify_password(stored, "")
+    assert not verify_password("secret1", "secret2")  # نص قديم قبل الترحيل
+    assert not verify_password(None, "secret1")
+    assert not verify_password("pbkdf2_sha256$broken", "secret1")
+
+
+def test_load_migrates_a_legacy_file_once(tmp_path):
+    path = tmp_path / "users.json"
+    _write_users(path, {"admin": {"password": "admin123"}, "ali": {"password": "pw", "role": "editor"}})
+    store = UserStore(str(path))
+
+    users = store.load()
+
+    on_disk = json.loads(path.read_text(encoding="utf-8"))
+    assert on_disk == users
+    assert all(is_password_hashed(data["password"]) for data in on_disk.values())
+    assert verify_password(users["admin"]["password"], "admin123")
+    assert verify_password(users["ali"]["password"], "pw")
+    assert users["ali"]["permissions"] == ["view", "edit"]
+    # تحميل ثان من مستخدم جديد لنفس الملف لا يعيد الكتابة
+    mtime = path.stat().st_mtime_ns
+    assert UserStore(str(path)).load() == users
+    assert path.stat().st_mtime_ns == mtime
+    assert [p.name for p in tmp_path.iterdir()] == ["users.json"]
+
+
+def test_save_hashes_plaintext_and_leaves_no_temp_file(tmp_path):
+    path = tmp_path / "users.json"
+    store = UserStore(str(path))
+
+    store.save({"ali": {"password": "pw", "role": "viewer"}})
+
+    on_disk = json.loads(path.read_text(encoding="utf-8"))
+    assert verify_password(on_disk["ali"]["password"], "pw")
+    assert [p.name for p in tmp_path.iterdir()] == ["users.json"]
+
+
+def test_failed_write_keeps_the_old_file_and_no_temp_file(tmp_path, monkeypatch):
+    path = tmp_path / "users.json"
+    store = UserStore(str(path))
+    store.save({"ali": {"password": "pw", "role": "viewer"}})
+    before = path.read_bytes()
+
+    def broken_dump(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(user_store.json, "dump", broken_dump)
+
+    with pytest.raises(OSError):
+        store.save({"ali": {"password": "new", "role": "viewer"}})
+
+    assert path.read_bytes() == before
+    assert [p.name for p in tmp_path.iterdir()] == ["users.json"]
@@ -0,0 +1,182 @@
+import threading
+import zipfile
+
+import pandas as pd
+import pytest
+
+import workbook_store
+from workbook_store import (
+    PatchNotApplicable,
+    StaleWorkbookError,
+    apply_change_set,
+    editor_change_set,
+    file_sha256,
+    patch_workbook_atomic,
+    write_workbook_atomic,
+)
+
+def _card_frame():
+    return pd.DataFrame({
+        "card": ["1", "1", None, "1"],
+        "Min_Tones": [0, 151, None, 301],
+        "Max_Tones": [150, 300, None, 450],
+        "Event": ["start", None, None, "visit"],
+    }, dtype=object)
+
+def _write(path, sheets, engine="openpyxl"):
+    with pd.ExcelWriter(path, engine=engine) as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+
+def _read(path, sheet):
+    df = pd.read_excel(path, sheet_name=sheet, dtype=object)
+    df.columns = df.columns.astype(str).str.strip()
+    return df
+
+@pytest.fixture
+def no_openpyxl_fallback(monkeypatch):
+    """يفشل الاختبار إذا لم يستخدم مسار XML المباشر"""
+    def fail(*args):
+        raise AssertionError("openpyxl fallback used")
+    monkeypatch.setattr(workbook_store, "_patch_with_openpyxl", fail)
+
+@pytest.fixture
+def openpyxl_calls(monkeypatch):
+    calls = []
+    original = workbook_store._patch_with_openpyxl
+    def spy(*args):
+        calls.append(args)
+        return original(*args)
+    monkeypatch.setattr(workbook_store, "_patch_with_openpyxl", spy)
+    return calls
+
+def _patch_and_compare(path, sheet, editor_state):
+    before = _read(path, sheet)
+    change_set = editor_change_set(editor_state, before)
+    patch_workbook_atomic(str(path), {sheet: change_set})
+    after = _read(path, sheet)
+    expected = apply_change_set(before, change_set)
+    pd.testing.assert_frame_equal(after.astype(str), expected.astype(str))
+    return after
+
+def test_cell_edit_rewrites_only_the_edited_sheet(tmp_path, no_openpyxl_fallback):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame(), "Card2": _card_frame()})
+    with zipfile.ZipFile(path) as z:
+        other_before = z.read("xl/worksheets/sheet2.xml")
+
+    after = _patch_and_compare(path, "Card1", {"edited_rows": {0: {"Min_Tones": "5", "Event": "changed"}}})
+
+    assert after.at[0, "Min_Tones"] == 5
+    assert after.at[0, "Event"] == "changed"
+    with zipfile.ZipFile(path) as z:
+        assert z.read("xl/worksheets/sheet2.xml") == other_before
+
+def test_edit_in_row_missing_from_xml_creates_the_row(tmp_path, no_openpyxl_fallback):
+    import openpyxl
+
+    path = tmp_path / "book.xlsx"
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Card1"
+    ws.append(["card", "Min_Tones", "Max_Tones", "Event"])
+    ws.append(["1", 0, 150, "start"])
+    ws.append([])
+    ws.append(["1", 301, 450, "visit"])
+    wb.save(path)
+    with zipfile.ZipFile(path) as z:
+        assert b'<row r="3"' not in z.read("xl/worksheets/sheet1.xml")
+
+    after = _patch_and_compare(path, "Card1", {"edited_rows": {1: {"Event": "filled"}}})
+
+    assert after.at[1, "Event"] == "filled"
+    assert after.at[2, "Event"] == "visit"
+
+def test_inline_strings_keep_spaces_and_escape_markup(tmp_path, no_openpyxl_fallback):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame()})
+
+    after = _patch_and_compare(path, "Card1", {"edited_rows": {1: {"Event": " a<b> & c "}}})
+
+    assert after.at[1, "Event"] == " a<b> & c "
+
+def test_shared_string_headers_are_resolved(tmp_path, no_openpyxl_fallback):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame()}, engine="xlsxwriter")
+
+    after = _patch_and_compare(path, "Card1", {"edited_rows": {3: {"Max_Tones": "460", "card": ""}}})
+
+    assert after.at[3, "Max_Tones"] == 460
+    assert pd.isna(after.at[3, "card"])
+
+def test_row_changes_fall_back_to_openpyxl(tmp_path, openpyxl_calls):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame()})
+
+    after = _patch_and_compare(path, "Card1", {
+        "deleted_rows": [1],
+        "added_rows": [{"card": "1", "Min_Tones": "451", "Max_Tones": "550"}],
+        "edited_rows": {0: {"Event": "edited"}},
+    })
+
+    assert len(openpyxl_calls) == 1
+    assert len(after) == 4
+    assert after.at[0, "Event"] == "edited"
+
+def test_duplicate_header_is_not_patched_silently(tmp_path, openpyxl_calls):
+    path = tmp_path / "book.xlsx"
+    df = _card_frame()
+    df.columns = ["card", "Min_Tones", "Max_Tones", "card"]
+    _write(path, {"Card1": df})
+    before_sha = file_sha256(path)
+    change_set = editor_change_set({"edited_rows": {0: {"card": "2"}}}, _read(path, "Card1"))
+
+    with pytest.raises(PatchNotApplicable):
+        patch_workbook_atomic(str(path), {"Card1": change_set})
+
+    assert len(openpyxl_calls) == 1
+    assert file_sha256(path) == before_sha
+
+def test_patch_refuses_a_different_workbook_version(tmp_path):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame()})
+    change_set = editor_change_set({"edited_rows": {0: {"Event": "late"}}}, _read(path, "Card1"))
+    stale_sha = file_sha256(path)
+    _write(path, {"Card1": _card_frame().iloc[1:]})
+    current_sha = file_sha256(path)
+
+    with pytest.raises(StaleWorkbookError):
+        patch_workbook_atomic(str(path), {"Card1": change_set}, expected_sha=stale_sha)
+
+    assert file_sha256(path) == current_sha
+
+def test_concurrent_saves_of_one_version_keep_exactly_one(tmp_path):
+    path = tmp_path / "book.xlsx"
+    _write(path, {"Card1": _card_frame()})
+    base_sha = file_sha256(path)
+    barrier = threading.Barrier(4)
+    outcomes = []
+
+    def save(i):
+        change_set = editor_change_set({"edited_rows": {0: {"Event": f"edit {i}"}}}, _card_frame())
+        barrier.wait()
+        try:
+            if i % 2:
+                patch_workbook_atomic(str(path), {"Card1": change_set}, expected_sha=base_sha)
+            else:
+                sheets = {"Card1": apply_change_set(_card_frame(), change_set)}
+                write_workbook_atomic(str(path), sheets, ["Card1"], expected_sha=base_sha)
+            outcomes.append(i)
+        except StaleWorkbookError:
+            outcomes.append(None)
+
+    threads = [threading.Thread(target=save, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    saved = [i for i in outcomes if i is not None]
+    assert len(saved) == 1 and outcomes.count(None) == 3
+    assert _read(path, "Card1").iloc[0]["Event"] == f"edit {saved[0]}"
+    assert [p.name for p in tmp_path.iterdir()] == ["book.xlsx"]
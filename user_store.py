@@ -0,0 +1,134 @@
+import base64
+import copy
+import functools
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+from datetime import datetime
+
+# ===============================
+# 👥 بيانات المستخدمين - كلمات مرور مشفرة (PBKDF2) وتخزين حسب إصدار الملف
+# ===============================
+PASSWORD_SCHEME = "pbkdf2_sha256"
+PASSWORD_ITERATIONS = 600_000
+
+ROLE_PERMISSIONS = {
+    "admin": ["all"],
+    "editor": ["view", "edit"],
+    "viewer": ["view"],
+}
+
+DEFAULT_USERS = {
+    "admin": {"password": "admin123", "role": "admin"},
+    "user1": {"password": "user1123", "role": "editor"},
+    "user2": {"password": "user2123", "role": "viewer"},
+}
+
+def hash_password(password, iterations=PASSWORD_ITERATIONS):
+    """تشفير كلمة المرور بملح عشوائي: pbkdf2_sha256$iterations$salt$hash"""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join([
+        PASSWORD_SCHEME, str(iterations),
+        base64.b64encode(salt).decode("ascii"), base64.b64encode(digest).decode("ascii"),
+    ])
+
+def is_password_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(PASSWORD_SCHEME + "$")
+
+def verify_password(stored, password):
+    """مقارنة كلمة المرور بالقيمة المخزنة (مشفرة أو نص قديم قبل الترحيل)"""
+    if not isinstance(stored, str) or not isinstance(password, str):
+        return False
+    if not is_password_hashed(stored):
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    try:
+        _, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), base64.b64decode(salt), int(iterations))
+    except Exception:
+        return False
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+def migrate_user_record(username, user_data):
+    """إكمال الحقول الناقصة وتشفير كلمة المرور النصية - يرجع True إذا تغير السجل"""
+    changed = False
+    if "role" not in user_data:
+        # تحديد الدور بناءً على اسم المستخدم إذا لم يكن موجوداً
+        user_data["role"] = "admin" if username == "admin" else "viewer"
+        user_data["permissions"] = list(ROLE_PERMISSIONS[user_data["role"]])
+        changed = True
+    if "permissions" not in user_data:
+        # تعيين الصلاحيات الافتراضية بناءً على الدور
+        user_data["permissions"] = list(ROLE_PERMISSIONS.get(user_data["role"], ["view"]))
+        changed = True
+    if "created_at" not in user_data:
+        user_data["created_at"] = datetime.now().isoformat()
+        changed = True
+    if "password" in user_data and not is_password_hashed(user_data["password"]):
+        user_data["password"] = hash_password(str(user_data["password"]))
+        changed = True
+    return changed
+
+@functools.lru_cache(maxsize=1)
+def _hashed_default_users():
+    users = copy.deepcopy(DEFAULT_USERS)
+    for username, user_data in users.items():
+        migrate_user_record(username, user_data)
+    return users
+
+def default_users():
+    """المستخدمون الافتراضيون (عند إنشاء الملف لأول مرة أو تلفه)"""
+    return copy.deepcopy(_hashed_default_users())
+
+class UserStore:
+    """ملف المستخدمين مقروء ومرحّل مرة واحدة لكل إصدار (وقت التعديل + الحجم)"""
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._version = None
+        self._users = None
+
+    def _file_version(self):
+        stat = os.stat(self._path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """نسخة من المستخدمين - القراءة والترحيل فقط عند تغير الملف"""
+        with self._lock:
+            if not os.path.exists(self._path):
+                self._write(default_users())
+            version = self._file_version()
+            if version != self._version:
+                with open(self._path, "r", encoding="utf-8") as f:
+                    users = json.load(f)
+                # الترحيل يكتب في الملف مرة واحدة فقط
+                changed = [migrate_user_record(username, data) for username, data in users.items()]
+                if any(changed):
+                    self._write(users)
+                    version = self._file_version()
+                self._users, self._version = users, version
+            return copy.deepcopy(self._users)
+
+    def save(self, users):
+        """حفظ المستخدمين (أي كلمة مرور نصية تشفر قبل الكتابة)"""
+        users = copy.deepcopy(users)
+        for username, data in users.items():
+            migrate_user_record(username, data)
+        with self._lock:
+            self._write(users)
+            self._users, self._version = users, self._file_version()
+
+    def _write(self, users):
+        """كتابة مؤقتة ثم إعادة تسمية حتى لا يبقى الملف نصف مكتوب"""
+        tmp_path = f"{self._path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(users, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
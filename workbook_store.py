@@ -0,0 +1,790 @@
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from perf_spans import count, span
+from service_engine import RowInsertIndex, TonnageIndex, resolve_sheet_schema
+
+# ===============================
+# 📂 قراءة ملف Excel وتخزين الشيتات - بدون Streamlit (للتطبيق وسطر الأوامر)
+# ===============================
+SIDECAR_DIR = ".sheets_cache"
+SIDECAR_KEEP_VERSIONS = 3
+
+def _copy_on_write_enabled():
+    """Copy-on-Write مفعل افتراضياً منذ pandas 3 - قبلها يفعله التطبيق بنفسه (app.py)"""
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    return pd.get_option("mode.copy_on_write") is True
+
+def _light_copy(df):
+    """نسخة خفيفة مع Copy-on-Write وإلا نسخة كاملة حتى لا تعدل الشيتات المشتركة"""
+    return df.copy(deep=not _copy_on_write_enabled())
+
+def file_sha256(path):
+    """حساب بصمة SHA-256 لمحتوى الملف"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -------------------------------
+# 💽 نسخة سريعة من الشيتات على القرص (sidecar) حسب بصمة الملف
+# -------------------------------
+def sidecar_folder(workbook_sha, sidecar_dir=SIDECAR_DIR):
+    return os.path.join(sidecar_dir, workbook_sha)
+
+def remove_sidecar_version(workbook_sha, sidecar_dir=SIDECAR_DIR):
+    """حذف النسخة السريعة لإصدار واحد من الملف"""
+    shutil.rmtree(sidecar_folder(workbook_sha, sidecar_dir), ignore_errors=True)
+
+def read_sidecar_manifest(workbook_sha, sidecar_dir=SIDECAR_DIR):
+    """قائمة الشيتات المحفوظة لهذه البصمة (أو None)"""
+    manifest_path = os.path.join(sidecar_folder(workbook_sha, sidecar_dir), "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)["sheets"]
+    except Exception:
+        return None
+
+def write_sidecar_manifest(workbook_sha, sheet_names, sidecar_dir=SIDECAR_DIR):
+    """إنشاء مجلد البصمة مع قائمة الشيتات ثم حذف النسخ القديمة"""
+    folder = sidecar_folder(workbook_sha, sidecar_dir)
+    entries = [{"sheet": name, "file": f"sheet_{i}.pkl"} for i, name in enumerate(sheet_names)]
+    try:
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = os.path.join(folder, f"manifest.json.tmp{os.getpid()}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sha256": workbook_sha, "sheets": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(folder, "manifest.json"))
+    except Exception:
+        return entries
+
+    # الإبقاء على أحدث النسخ فقط
+    versions = [
+        os.path.join(sidecar_dir, d) for d in os.listdir(sidecar_dir)
+        if os.path.isdir(os.path.join(sidecar_dir, d))
+    ]
+    versions.sort(key=os.path.getmtime, reverse=True)
+    for old_folder in versions[SIDECAR_KEEP_VERSIONS:]:
+        shutil.rmtree(old_folder, ignore_errors=True)
+    return entries
+
+def _sidecar_sheet_path(workbook_sha, sheet_name, sidecar_dir=SIDECAR_DIR):
+    for entry in read_sidecar_manifest(workbook_sha, sidecar_dir) or []:
+        if entry["sheet"] == sheet_name:
+            return os.path.join(sidecar_folder(workbook_sha, sidecar_dir), entry["file"])
+    return None
+
+def read_sheet_sidecar(workbook_sha, sheet_name, sidecar_dir=SIDECAR_DIR):
+    """قراءة شيت واحد من النسخة المحفوظة لهذه البصمة إن وجد"""
+    path = _sidecar_sheet_path(workbook_sha, sheet_name, sidecar_dir)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with span("sidecar_read"):
+            return pd.read_pickle(path)
+    except Exception:
+        return None
+
+def write_sheet_sidecar(workbook_sha, sheet_name, df, sidecar_dir=SIDECAR_DIR):
+    """حفظ شيت واحد في مجلد البصمة (كتابة مؤقتة ثم إعادة تسمية)"""
+    path = _sidecar_sheet_path(workbook_sha, sheet_name, sidecar_dir)
+    if not path:
+        return
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# -------------------------------
+# 🗃 مخزن الشيتات حسب إصدار الملف
+# -------------------------------
+class VersionedSheetCache:
+    """مخزن للشيتات مفهرس ببصمة الملف - يحذف أقدم الإصدارات (LRU) ويمسح إصداراً واحداً عند الطلب"""
+
+    def __init__(self, max_versions):
+        self._max_versions = max_versions
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, version, key, loader):
+        with self._lock:
+            entries = self._versions.get(version)
+            if entries is not None:
+                self._versions.move_to_end(version)
+                if key in entries:
+                    self.hits += 1
+                    count("cache_hit")
+                    return entries[key]
+            self.misses += 1
+        count("cache_miss")
+
+        value = loader()
+        # القيم الفارغة (فشل القراءة) لا تخزن حتى يعاد المحاولة
+        if value is None:
+            return None
+
+        with self._lock:
+            self._versions.setdefault(version, {})[key] = value
+            self._versions.move_to_end(version)
+            while len(self._versions) > self._max_versions:
+                self._versions.popitem(last=False)
+        return value
+
+    def put(self, version, key, value):
+        """تخزين قيمة محدثة مباشرة (مثل فهرس بعد إضافة صفوف) لإصدار موجود في المخزن"""
+        with self._lock:
+            entries = self._versions.get(version)
+            if entries is not None:
+                entries[key] = value
+
+    def carry_over(self, old_version, new_version, keep, extra=None):
+        """نسخ مدخلات الإصدار القديم التي تحقق keep(key) إلى الإصدار الجديد (بدون نسخ البيانات)"""
+        with self._lock:
+            entries = self._versions.get(old_version)
+            if entries is None:
+                return 0
+            carried = {key: value for key, value in entries.items() if keep(key)}
+            carried.update(extra or {})
+            self._versions.setdefault(new_version, {}).update(carried)
+            self._versions.move_to_end(new_version)
+            while len(self._versions) > self._max_versions:
+                self._versions.popitem(last=False)
+        return len(carried)
+
+    def invalidate(self, version):
+        """مسح كل ما يخص إصداراً واحداً فقط"""
+        with self._lock:
+            self._versions.pop(version, None)
+
+    def versions(self):
+        with self._lock:
+            return list(self._versions.keys())
+
+# -------------------------------
+# 📑 قراءة شيت واحد من الملف
+# -------------------------------
+def read_sheet_names(path, workbook_sha, sidecar_dir=SIDECAR_DIR):
+    """أسماء الشيتات بالترتيب - من النسخة السريعة أو من الملف مباشرة"""
+    entries = read_sidecar_manifest(workbook_sha, sidecar_dir)
+    if entries is None:
+        import openpyxl
+
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            with span("sheet_names"):
+                wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True)
+            try:
+                sheet_names = list(wb.sheetnames)
+            finally:
+                wb.close()
+        except Exception:
+            return []
+        # لا تحفظ النسخة السريعة إذا تغير الملف بعد حساب البصمة
+        if hashlib.sha256(content).hexdigest() != workbook_sha:
+            return sheet_names
+        entries = write_sidecar_manifest(workbook_sha, sheet_names, sidecar_dir)
+    return [entry["sheet"] for entry in entries]
+
+def read_sheet_raw(path, workbook_sha, sheet_name, sidecar_dir=SIDECAR_DIR):
+    """قراءة شيت واحد (dtype=object) - من النسخة السريعة إن وجدت"""
+    df = read_sheet_sidecar(workbook_sha, sheet_name, sidecar_dir)
+    if df is not None:
+        return df
+
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+
+        # قراءة الشيت مع dtype=object للحفاظ على تنسيق البيانات
+        with span("excel_parse"):
+            df = pd.read_excel(io.BytesIO(content), sheet_name=sheet_name, dtype=object)
+
+        # تنظيف أسماء الأعمدة
+        df.columns = df.columns.astype(str).str.strip()
+
+        # لا تحفظ النسخة السريعة إذا تغير الملف بعد حساب البصمة
+        if hashlib.sha256(content).hexdigest() == workbook_sha:
+            write_sheet_sidecar(workbook_sha, sheet_name, df, sidecar_dir)
+
+        return df
+    except Exception:
+        return None
+
+def typed_sheet_view(raw_df):
+    """استنتاج أنواع الأعمدة من القراءة الخام بنفس طريقة read_excel الافتراضية"""
+    if len(raw_df.columns) == 0:
+        return raw_df.copy()
+    with span("typed_view"):
+        rows = [list(raw_df.columns)] + raw_df.to_numpy().tolist()
+        return TextParser(rows, header=0).read()
+
+# -------------------------------
+# 💾 حفظ الملف (الشيتات المعدلة فقط + استبدال ذري)
+# -------------------------------
+def _write_sheet(writer, name, sh):
+    try:
+        sh.to_excel(writer, sheet_name=name, index=False)
+    except Exception:
+        sh.astype(object).to_excel(writer, sheet_name=name, index=False)
+
+class StaleWorkbookError(Exception):
+    """الملف على القرص ليس الإصدار الذي بنيت عليه التعديلات"""
+
+# جلسات Streamlit خيوط في عملية واحدة: فحص الإصدار والكتابة والاستبدال تتم تحت قفل واحد
+# حتى لا يمر حفظان متزامنان من الفحص ويضيع تعديل أحدهما (المزامنة من GitHub تأخذ القفل نفسه)
+WORKBOOK_WRITE_LOCK = threading.RLock()
+
+def _workbook_tmp_path(path):
+    """ملف مؤقت باسم فريد بجانب الملف (نفس القرص حتى يكون os.replace ذرياً)"""
+    root, ext = os.path.splitext(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(root)}.", suffix=f".tmp{ext}", dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    return tmp_path
+
+def check_workbook_version(path, expected_sha):
+    """رفض الكتابة إذا تغير الملف بعد قراءة الإصدار expected_sha (None = بدون فحص)"""
+    if expected_sha and os.path.exists(path) and file_sha256(path) != expected_sha:
+        raise StaleWorkbookError(f"{path} changed since version {expected_sha[:12]}")
+
+def write_workbook_atomic(path, sheets_dict, dirty_sheets=None, expected_sha=None):
+    """كتابة الشيتات المعدلة فقط في نسخة مؤقتة ثم استبدال الملف دفعة واحدة"""
+    with WORKBOOK_WRITE_LOCK:
+        check_workbook_version(path, expected_sha)
+        tmp_path = _workbook_tmp_path(path)
+        try:
+            if dirty_sheets is not None and os.path.exists(path):
+                # باقي الشيتات تبقى كما هي داخل الملف
+                shutil.copy2(path, tmp_path)
+                with pd.ExcelWriter(tmp_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+                    for name in dirty_sheets:
+                        _write_sheet(writer, name, sheets_dict[name])
+            else:
+                with pd.ExcelWriter(tmp_path, engine="openpyxl") as writer:
+                    for name, sh in sheets_dict.items():
+                        _write_sheet(writer, name, sh)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def carry_over_version(cache, old_sha, new_sha, changed_sheets, sheet_names, sidecar_dir=SIDECAR_DIR):
+    """نقل الشيتات غير المعدلة (في الذاكرة وعلى القرص) لبصمة الملف الجديدة حتى لا يعاد تحليلها"""
+    if not old_sha or not new_sha or old_sha == new_sha:
+        return 0
+    changed = set(changed_sheets)
+    sheet_names = list(sheet_names)
+    carried = cache.carry_over(
+        old_sha, new_sha, lambda key: key[0] != "names" and key[1] not in changed, {("names",): sheet_names}
+    )
+
+    old_entries = read_sidecar_manifest(old_sha, sidecar_dir)
+    if old_entries is None:
+        return carried
+    old_files = {entry["sheet"]: entry["file"] for entry in old_entries}
+    new_folder = sidecar_folder(new_sha, sidecar_dir)
+    for entry in write_sidecar_manifest(new_sha, sheet_names, sidecar_dir):
+        name = entry["sheet"]
+        old_path = os.path.join(sidecar_folder(old_sha, sidecar_dir), old_files.get(name, ""))
+        if name in changed or name not in old_files or not os.path.exists(old_path):
+            continue
+        new_path = os.path.join(new_folder, entry["file"])
+        try:
+            # ربط صلب (بدون نسخ) إن أمكن
+            os.link(old_path, new_path)
+        except OSError:
+            try:
+                shutil.copyfile(old_path, new_path)
+            except OSError:
+                pass
+    return carried
+
+# -------------------------------
+# 🩹 مجموعة تغييرات المحرر (خلايا معدلة + صفوف مضافة + صفوف محذوفة)
+# -------------------------------
+# الشكل: {"edited": {صف: {عمود: قيمة}}, "added": [{عمود: قيمة}], "deleted": [صف], "insert_at": صف}
+# أرقام الصفوف هي مواضع في الشيت كاملاً (بدون صف العناوين)
+EMPTY_CELL_TEXTS = {"", "nan", "None", "NaT", "<NA>"}
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+
+def coerce_cell_value(value, reference=None):
+    """تحويل نص المحرر لنوع القيمة الأصلية (رقم يبقى رقماً والنص الفارغ يصبح خلية فارغة)"""
+    if not isinstance(value, str):
+        return None if value is None or pd.isna(value) else value
+    if value.strip() in EMPTY_CELL_TEXTS:
+        return None
+    if _is_number(reference):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            return value
+        if not math.isfinite(number):
+            return value
+        return int(number) if number.is_integer() else number
+    return value
+
+def _column_reference(series):
+    """أول قيمة غير فارغة في العمود (لمعرفة نوعه عند إضافة صف)"""
+    non_null = series.dropna()
+    return non_null.iloc[0] if len(non_null) else None
+
+def editor_change_set(editor_state, df, start=0, end=None):
+    """تحويل حالة data_editor لصفحة [start:end] من الشيت df إلى مجموعة تغييرات بقيم مكتملة الأنواع"""
+    editor_state = editor_state or {}
+    end = len(df) if end is None else end
+    deleted = sorted({start + int(pos) for pos in editor_state.get("deleted_rows", [])})
+    deleted_set = set(deleted)
+
+    edited = {}
+    for pos, cells in editor_state.get("edited_rows", {}).items():
+        row = start + int(pos)
+        if row in deleted_set or row >= len(df):
+            continue
+        row_cells = {}
+        for col, value in cells.items():
+            if col in df.columns:
+                row_cells[col] = coerce_cell_value(value, df.iat[row, df.columns.get_loc(col)])
+        if row_cells:
+            edited[row] = row_cells
+
+    added = []
+    for row_values in editor_state.get("added_rows", []):
+        added.append({
+            col: coerce_cell_value(value, _column_reference(df[col]))
+            for col, value in row_values.items() if col in df.columns
+        })
+    return {"edited": edited, "added": added, "deleted": deleted, "insert_at": end}
+
+def change_set_size(change_set):
+    """عدد الخلايا المعدلة + الصفوف المضافة + الصفوف المحذوفة"""
+    if not change_set:
+        return 0
+    edited_cells = sum(len(cells) for cells in change_set["edited"].values())
+    return edited_cells + len(change_set["added"]) + len(change_set["deleted"])
+
+def _insert_position(change_set):
+    """موضع إضافة الصفوف بعد حذف الصفوف التي قبله"""
+    return change_set["insert_at"] - sum(1 for row in change_set["deleted"] if row < change_set["insert_at"])
+
+def apply_change_set(df, change_set):
+    """تطبيق التغييرات على نسخة من الشيت - الأعمدة غير المعدلة لا تنسخ (Copy-on-Write)"""
+    df = _light_copy(df)
+    for row, cells in change_set["edited"].items():
+        for col, value in cells.items():
+            df.iat[int(row), df.columns.get_loc(col)] = value
+    if change_set["deleted"]:
+        df = df.drop(index=df.index[change_set["deleted"]]).reset_index(drop=True)
+    if change_set["added"]:
+        position = _insert_position(change_set)
+        new_rows = pd.DataFrame(change_set["added"], columns=df.columns, dtype=object)
+        df = pd.concat([df.iloc[:position], new_rows, df.iloc[position:]], ignore_index=True)
+    return df
+
+# ملفات xlsx: كل شيت ملف XML داخل أرشيف zip
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+class PatchNotApplicable(Exception):
+    """التغييرات لا يمكن كتابتها كخلايا (مثل عمود بلا عنوان أو عنوان مكرر) - يجب حفظ الشيت كاملاً"""
+
+class _XmlPatchUnsupported(Exception):
+    """الملف أو القيمة لا يمكن تعديلها مباشرة في XML - يستخدم openpyxl بدلاً منها"""
+
+def _q(tag):
+    return f"{{{_MAIN_NS}}}{tag}"
+
+def _sheet_parts(zin):
+    """اسم الشيت -> مسار ملف XML الخاص به داخل الأرشيف"""
+    workbook = ET.fromstring(zin.read("xl/workbook.xml"))
+    rels = ET.fromstring(zin.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{_PKG_REL_NS}}}Relationship")}
+    parts = {}
+    for sheet in workbook.iter(_q("sheet")):
+        target = targets.get(sheet.get(f"{{{_REL_NS}}}id"), "")
+        parts[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    return parts
+
+def _shared_strings(zin):
+    if "xl/sharedStrings.xml" not in zin.namelist():
+        return []
+    root = ET.fromstring(zin.read("xl/sharedStrings.xml"))
+    return ["".join(t.text or "" for t in si.iter(_q("t"))) for si in root.iter(_q("si"))]
+
+def _cell_text(cell, shared):
+    """قيمة خلية العنوان كنص (كما تقرأها pandas)"""
+    kind = cell.get("t")
+    if kind == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(_q("t")))
+    v = cell.find(_q("v"))
+    if v is None or v.text is None:
+        return None
+    return shared[int(v.text)] if kind == "s" else v.text
+
+def _split_ref(ref):
+    letters = ref.rstrip("0123456789")
+    return letters, int(ref[len(letters):])
+
+def _set_cell_value(cell, value):
+    """كتابة قيمة في عنصر الخلية مع الإبقاء على تنسيقها (s)"""
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    for child in list(cell):
+        cell.remove(child)
+    cell.attrib.pop("t", None)
+    if value is None:
+        return
+    if isinstance(value, str):
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise _XmlPatchUnsupported("illegal characters")
+        cell.set("t", "inlineStr")
+        text = ET.SubElement(ET.SubElement(cell, _q("is")), _q("t"))
+        text.text = value
+        if value != value.strip():
+            text.set(_XML_SPACE, "preserve")
+    elif _is_number(value) and math.isfinite(value):
+        ET.SubElement(cell, _q("v")).text = str(int(value)) if float(value).is_integer() else repr(float(value))
+    else:
+        raise _XmlPatchUnsupported(type(value).__name__)
+
+def _patch_sheet_xml(content, edited, shared):
+    """تعديل خلايا محددة في XML شيت واحد (بدون قراءة باقي الشيتات)"""
+    from openpyxl.utils import column_index_from_string
+
+    namespaces = dict(
+        ns for _, ns in ET.iterparse(io.BytesIO(content), events=["start-ns"])
+    )
+    # ElementTree يحذف تعريفات النطاقات غير المستخدمة - ملفات Excel الأصلية تعتمد عليها
+    if set(namespaces.values()) - {_MAIN_NS, _REL_NS}:
+        raise _XmlPatchUnsupported("extra namespaces")
+    for prefix, uri in namespaces.items():
+        ET.register_namespace(prefix, uri)
+
+    root = ET.fromstring(content)
+    sheet_data = root.find(_q("sheetData"))
+    rows = {}
+    for row in sheet_data.findall(_q("row")):
+        if row.get("r") is None:
+            raise _XmlPatchUnsupported("row without reference")
+        rows[int(row.get("r"))] = row
+    if 1 not in rows:
+        raise _XmlPatchUnsupported("no header row")
+    header, duplicated = {}, set()
+    for cell in rows[1].findall(_q("c")):
+        text = _cell_text(cell, shared)
+        if text is not None and cell.get("r"):
+            name = str(text).strip()
+            if name in header:
+                duplicated.add(name)
+            header[name] = _split_ref(cell.get("r"))[0]
+    # عنوان مكرر لا يحدد عموداً واحداً
+    for name in duplicated:
+        del header[name]
+
+    for data_row, cells in edited.items():
+        row_number = int(data_row) + 2
+        row = rows.get(row_number)
+        if row is None:
+            # صف فارغ بالكامل غير موجود في XML - يضاف في مكانه
+            row = ET.Element(_q("row"), r=str(row_number))
+            after = [r for r in rows if r < row_number]
+            position = list(sheet_data).index(rows[max(after)]) + 1
+            sheet_data.insert(position, row)
+            rows[row_number] = row
+        for col, value in cells.items():
+            if col not in header:
+                raise _XmlPatchUnsupported(f"column {col}")
+            ref = f"{header[col]}{row_number}"
+            existing = row.findall(_q("c"))
+            cell = next((c for c in existing if c.get("r") == ref), None)
+            if cell is None:
+                if any(c.get("r") is None for c in existing):
+                    raise _XmlPatchUnsupported("cell without reference")
+                column = column_index_from_string(header[col])
+                position = sum(
+                    1 for c in existing if column_index_from_string(_split_ref(c.get("r"))[0]) < column
+                )
+                cell = ET.Element(_q("c"), r=ref)
+                row.insert(position, cell)
+            _set_cell_value(cell, value)
+    return ET.tostring(root, encoding="UTF-8", xml_declaration=True)
+
+def _patch_cells_in_zip(path, tmp_path, patches):
+    """تعديل خلايا فقط: إعادة كتابة XML الشيتات المعدلة ونسخ باقي الأرشيف كما هو"""
+    with zipfile.ZipFile(path) as zin:
+        parts = _sheet_parts(zin)
+        shared = None
+        patched = {}
+        for sheet_name, change_set in patches.items():
+            if sheet_name not in parts:
+                raise _XmlPatchUnsupported(f"sheet {sheet_name}")
+            if shared is None:
+                shared = _shared_strings(zin)
+            patched[parts[sheet_name]] = _patch_sheet_xml(zin.read(parts[sheet_name]), change_set["edited"], shared)
+        with zipfile.ZipFile(tmp_path, "w") as zout:
+            for info in zin.infolist():
+                zout.writestr(info, patched.get(info.filename) or zin.read(info))
+
+def _patch_with_openpyxl(path, tmp_path, patches):
+    """إضافة وحذف الصفوف (ونسخة احتياطية لتعديل الخلايا) عبر openpyxl"""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path)
+    for sheet_name, change_set in patches.items():
+        if sheet_name not in wb.sheetnames:
+            raise PatchNotApplicable(f"sheet {sheet_name}")
+        ws = wb[sheet_name]
+        # الصف الأول عناوين الأعمدة - صف البيانات رقم r في الملف هو r + 2
+        header = {}
+        for cell in ws[1]:
+            if cell.value is not None:
+                header.setdefault(str(cell.value).strip(), []).append(cell.column)
+        # عمود بلا عنوان (Unnamed: N في pandas) أو بعنوان مكرر (X.1) لا يمكن تحديد مكانه بالاسم
+        columns = {col for cells in change_set["edited"].values() for col in cells}
+        columns |= {col for row_values in change_set["added"] for col in row_values}
+        unknown = sorted(col for col in columns if len(header.get(col, [])) != 1)
+        if unknown:
+            raise PatchNotApplicable(f"{sheet_name}: columns {unknown}")
+        header = {name: cols[0] for name, cols in header.items()}
+
+        for row, cells in change_set["edited"].items():
+            for col, value in cells.items():
+                ws.cell(row=int(row) + 2, column=header[col], value=value)
+        for row in sorted(change_set["deleted"], reverse=True):
+            ws.delete_rows(int(row) + 2)
+        if change_set["added"]:
+            first_row = _insert_position(change_set) + 2
+            ws.insert_rows(first_row, amount=len(change_set["added"]))
+            for i, row_values in enumerate(change_set["added"]):
+                for col, value in row_values.items():
+                    ws.cell(row=first_row + i, column=header[col], value=value)
+    wb.save(tmp_path)
+
+def patch_workbook_atomic(path, patches, expected_sha=None):
+    """كتابة خلايا التغييرات فقط في نسخة مؤقتة ثم استبدال الملف - patches: {شيت: مجموعة تغييرات}
+
+    expected_sha: بصمة الإصدار الذي أخذت منه أرقام الصفوف (StaleWorkbookError إذا تغير الملف).
+    PatchNotApplicable: لا شيء يكتب - على المستدعي حفظ الشيتات كاملة بـ write_workbook_atomic."""
+    with WORKBOOK_WRITE_LOCK:
+        check_workbook_version(path, expected_sha)
+        tmp_path = _workbook_tmp_path(path)
+        try:
+            cells_only = all(not cs["added"] and not cs["deleted"] for cs in patches.values())
+            try:
+                if not cells_only:
+                    raise _XmlPatchUnsupported("rows added or deleted")
+                _patch_cells_in_zip(path, tmp_path, patches)
+            except _XmlPatchUnsupported:
+                _patch_with_openpyxl(path, tmp_path, patches)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def append_patch_log(path, sheet_name, change_set, user=None, base_sha=None):
+    """إضافة سطر JSON مختصر لكل حفظ (الخلايا المتغيرة فقط)"""
+    entry = {
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "user": user,
+        "sheet": sheet_name,
+        "base": base_sha,
+        "edited": {str(row): cells for row, cells in change_set["edited"].items()},
+        "added": change_set["added"],
+        "deleted": change_set["deleted"],
+        "insert_at": change_set["insert_at"],
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+# -------------------------------
+# 📥 تصدير جداول النتائج (Excel / CSV)
+# -------------------------------
+# xlsxwriter اختياري وأسرع من openpyxl في كتابة ملف جديد (لا يستورد إلا عند التصدير)
+XLSXWRITER_AVAILABLE = importlib.util.find_spec("xlsxwriter") is not None
+
+EXPORT_FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+}
+
+def frame_digest(df):
+    """بصمة محتوى الجدول (الأعمدة + القيم) لتخزين ملفات التصدير"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(col) for col in df.columns], ensure_ascii=False).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def export_table_bytes(df, fmt="xlsx"):
+    """محتوى ملف التصدير للجدول بالصيغة المطلوبة"""
+    if fmt == "csv":
+        # utf-8-sig حتى يفتح Excel النص العربي بشكل صحيح
+        return df.to_csv(index=False).encode("utf-8-sig")
+    if fmt == "xlsx":
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False, engine="xlsxwriter" if XLSXWRITER_AVAILABLE else "openpyxl")
+        return buffer.getvalue()
+    raise ValueError(f"Unknown export format: {fmt}")
+
+# -------------------------------
+# 📤 قراءة ملف استيراد الأحداث (CSV / Excel)
+# -------------------------------
+IMPORT_EXTENSIONS = ("csv", "xlsx")
+
+def read_import_table(file_name, content):
+    """قراءة ملف الاستيراد كنصوص (الخلايا الفارغة None) وحذف الصفوف الفارغة بالكامل
+    - رقم الصف (index) يبقى موضعه في الملف حتى تشير رسائل الأخطاء للصف الصحيح"""
+    ext = os.path.splitext(file_name)[1].lower().lstrip(".")
+    if ext == "csv":
+        df = pd.read_csv(io.BytesIO(content), dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    elif ext == "xlsx":
+        df = pd.read_excel(io.BytesIO(content), dtype=str, keep_default_na=False)
+    else:
+        raise ValueError(f"Unsupported import file type: {ext}")
+    df.columns = df.columns.astype(str).str.strip()
+    df = df.map(lambda v: v.strip() or None if isinstance(v, str) else v)
+    return df.dropna(how="all")
+
+# -------------------------------
+# 📘 إصدار واحد من الملف - كل شيت ومشتقاته تحسب مرة واحدة
+# -------------------------------
+class WorkbookVersion:
+    """وصول كسول لشيتات إصدار محدد من الملف عبر المخزن المشترك"""
+
+    def __init__(self, path, workbook_sha, cache, sidecar_dir=SIDECAR_DIR):
+        self.path = path
+        self.sha = workbook_sha
+        self.cache = cache
+        self.sidecar_dir = sidecar_dir
+
+    def sheet_names(self):
+        """أسماء الشيتات بالترتيب دون قراءة محتواها"""
+        return self.cache.get_or_load(
+            self.sha, ("names",), lambda: read_sheet_names(self.path, self.sha, self.sidecar_dir)
+        ) or []
+
+    def raw(self, sheet_name):
+        """قراءة شيت واحد (dtype=object)"""
+        return self.cache.get_or_load(
+            self.sha, ("raw", sheet_name), lambda: read_sheet_raw(self.path, self.sha, sheet_name, self.sidecar_dir)
+        )
+
+    def typed(self, sheet_name):
+        """نسخة العرض بأنواع بيانات مستنتجة لشيت واحد"""
+        def build():
+            raw_df = self.raw(sheet_name)
+            return None if raw_df is None else typed_sheet_view(raw_df)
+        return self.cache.get_or_load(self.sha, ("typed", sheet_name), build)
+
+    def schema(self, sheet_name):
+        """تحديد أدوار الأعمدة لشيت واحد"""
+        def build():
+            df = self.typed(sheet_name)
+            return None if df is None else resolve_sheet_schema(df)
+        return self.cache.get_or_load(self.sha, ("schema", sheet_name), build)
+
+    def tonnage_index(self, sheet_name):
+        """فهرس نطاقات الأطنان لشيت واحد (الأحداث الفارغة تعتبر 0 كما في الفحص)"""
+        def build():
+            df = self.typed(sheet_name)
+            if df is None:
+                return None
+            with span("tonnage_index"):
+                return TonnageIndex.from_frame(df, fill_value=None if sheet_name == "ServicePlan" else 0)
+        return self.cache.get_or_load(self.sha, ("tonnage_index", sheet_name), build)
+
+    def row_insert_index(self, sheet_name):
+        """مفاتيح الأطنان المرتبة لإضافة الصفوف (من القراءة الخام التي يعدلها المحرر)"""
+        def build():
+            raw_df, schema = self.raw(sheet_name), self.schema(sheet_name)
+            if raw_df is None or schema is None:
+                return None
+            with span("row_insert_index"):
+                return RowInsertIndex.from_frame(raw_df, schema)
+        return self.cache.get_or_load(self.sha, ("row_insert_index", sheet_name), build)
+
+    def for_edit(self, sheet_name):
+        """نسخة تحرير خفيفة من الشيت الخام المشترك - البيانات لا تنسخ إلا عند تعديلها (Copy-on-Write)"""
+        raw_df = self.raw(sheet_name)
+        return None if raw_df is None else _light_copy(raw_df)
+
+    def lazy(self, loader):
+        """قاموس شيتات كسول باستخدام إحدى الدوال أعلاه (typed / schema / ...)"""
+        sheet_names = self.sheet_names()
+        if not sheet_names:
+            return None
+        return LazySheets(sheet_names, loader, self.sha)
+
+def open_workbook(path, cache=None, sidecar_dir=SIDECAR_DIR):
+    """فتح ملف Excel بحساب بصمته (مخزن خاص إن لم يمرر مخزن مشترك)"""
+    if not os.path.exists(path):
+        return None
+    return WorkbookVersion(path, file_sha256(path), cache or VersionedSheetCache(1), sidecar_dir)
+
+class LazySheets(MutableMapping):
+    """قاموس شيتات يقرأ كل شيت عند أول طلب فقط - version هي بصمة الملف الذي قرئت منه"""
+
+    def __init__(self, sheet_names, loader, version=None):
+        self.version = version
+        self._names = list(sheet_names)
+        self._loader = loader
+        self._loaded = {}
+        self._dirty = set()
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if name not in self._names:
+                raise KeyError(name)
+            self._loaded[name] = self._loader(name)
+        return self._loaded[name]
+
+    def __setitem__(self, name, df):
+        if name not in self._names:
+            self._names.append(name)
+        self._loaded[name] = df
+        self._dirty.add(name)
+
+    def __delitem__(self, name):
+        self._names.remove(name)
+        self._loaded.pop(name, None)
+        self._dirty.discard(name)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+    def dirty_sheets(self):
+        """أسماء الشيتات التي تم تعديلها بالترتيب"""
+        return [name for name in self._names if name in self._dirty]